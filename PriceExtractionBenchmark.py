@@ -0,0 +1,115 @@
+import argparse
+import glob
+import json
+import os
+import time
+
+import requests
+
+from PriceMonitoring import FALLBACK_EXTRACTOR, SITE_EXTRACTORS, RegexExtractor, SoupExtractor, parse_price
+
+EXTRACTORS = {
+    'regex (books.toscrape.com)': SITE_EXTRACTORS['books.toscrape.com'][0],
+    'regex (ogólny)': RegexExtractor(r'<p\b[^>]*\bclass="[^"]*\bprice_color\b[^"]*"[^>]*>([^<]+)</p>'),
+    'soup + SoupStrainer': SoupExtractor(strained=True),
+    'soup (pełne drzewo)': FALLBACK_EXTRACTOR,
+}
+
+
+def sample_page(n_categories=50, n_related=6):
+    """
+    Buduje stronę produktu o układzie books.toscrape.com (menu kategorii, opis, tabela, polecane),
+    używaną, gdy nie podano zapisanych stron.
+    """
+    categories = ''.join(f'<li><a href="../category/books/c_{i}/index.html">Category {i}</a></li>\n'
+                         for i in range(n_categories))
+    related = ''.join(f'<li class="col-xs-6"><article class="product_pod"><h3><a href="#">Book {i}</a></h3>'
+                      f'<div class="product_price"><p class="price_color_related">£{i}.00</p></div></article></li>\n'
+                      for i in range(n_related))
+    description = ' '.join(['Lorem ipsum dolor sit amet, consectetur adipiscing elit.'] * 40)
+    return (f'<!DOCTYPE html><html lang="en-us"><head><title>A Light in the Attic</title>'
+            f'<meta charset="utf-8"></head><body><div class="container-fluid page"><ul class="nav">{categories}</ul>'
+            f'<article class="product_page"><div class="col-sm-6 product_main"><h1>A Light in the Attic</h1>'
+            f'<p class="price_color">£51.77</p><p class="instock availability">In stock (22 available)</p></div>'
+            f'<div id="product_description"><p>{description}</p></div><table class="table table-striped">'
+            + ''.join(f'<tr><th>Row {i}</th><td>value {i}</td></tr>' for i in range(7)) +
+            f'</table></article><ul class="row">{related}</ul></div></body></html>')
+
+
+def fetch_pages(urls, directory):
+    """Zapisuje strony produktów do katalogu, zwraca listę ścieżek."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    with requests.Session() as session:
+        for i, url in enumerate(urls):
+            response = session.get(url, timeout=(3.05, 10))
+            path = os.path.join(directory, f"page_{i}.html")
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(response.text)
+            paths.append(path)
+    return paths
+
+
+def benchmark_extractors(pages, repeat=200):
+    """
+    Mierzy średni czas wydobycia ceny przez każdy ekstraktor.
+
+    Args:
+        pages (list): Treści stron HTML.
+        repeat (int): Liczba powtórzeń dla każdej strony. Domyślnie 200.
+
+    Returns:
+        dict: Dla każdego ekstraktora średni czas na stronę (µs) i liczba poprawnie odczytanych cen.
+    """
+    results = {}
+    expected = [FALLBACK_EXTRACTOR.extract(page) for page in pages]
+    for name, extractor in EXTRACTORS.items():
+        found = [extractor.extract(page) for page in pages]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for page in pages:
+                extractor.extract(page)
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            'us_per_page': elapsed / (repeat * len(pages)) * 1e6,
+            'matches_full_parse': sum(a == b for a, b in zip(found, expected)),
+            'pages': len(pages),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Porównanie ekstraktorów cen na zapisanych stronach.")
+    parser.add_argument('pages', nargs='*', help="Pliki HTML lub wzorce (np. pages/*.html).")
+    parser.add_argument('--fetch', nargs='+', default=[], help="Adresy stron do pobrania i zapisania.")
+    parser.add_argument('--pages-dir', default='saved_pages', help="Katalog na pobrane strony.")
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--output', default=None, help="Plik JSON z wynikami (domyślnie wypisanie na ekran).")
+    args = parser.parse_args()
+
+    paths = [path for pattern in args.pages for path in sorted(glob.glob(pattern))]
+    if args.fetch:
+        paths += fetch_pages(args.fetch, args.pages_dir)
+    pages = []
+    for path in paths:
+        with open(path, encoding='utf-8') as file:
+            pages.append(file.read())
+    if not pages:
+        print("Nie podano stron - użyto przykładowej strony produktu.")
+        pages = [sample_page()]
+
+    results = benchmark_extractors(pages, args.repeat)
+    for name, result in results.items():
+        print(f"{name}: {result['us_per_page']:.1f} µs/stronę, "
+              f"zgodnych z pełnym parsowaniem {result['matches_full_parse']}/{result['pages']}")
+    price = parse_price(FALLBACK_EXTRACTOR.extract(pages[0]) or '0 PLN')
+    report = {'config': vars(args), 'first_page_price_pln': price, 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+    else:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
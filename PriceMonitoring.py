@@ -1,43 +1,677 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
 import csv
 import re
 import time
 import threading
 import datetime
+import hashlib
+import os
+import sqlite3
+import ast
+import heapq
+import random
+import queue
+import bisect
+import itertools
+import math
+import json
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from html import unescape
+from urllib.parse import urljoin, urlsplit
 import matplotlib.pyplot as plt
+
+from ProcessContext import pool_context
+
+
+def parse_price(price_text):
+    # Strip out any non-numeric characters and convert the price to PLN
+    price_number = re.sub(r'[^\d.,]', '', price_text)  # Regex
+
+    price_number = price_number.replace(',', '.')
+
+    price = float(price_number)
+    if '£' in price_text:
+        price *= 5
+    elif 'PLN' in price_text:
+        pass
+    elif 'USD' in price_text or '$' in price_text:
+        price *= 4
+    elif 'EUR' in price_text or '€' in price_text:
+        price *= 4.4
+    else:
+        print('Nie rozpoznano waluty')
+        price = 0
+    return price
+
+
+class RegexExtractor:
+    # Fastest path: a precompiled pattern run directly on the raw page, no HTML tree at all
+    def __init__(self, pattern):
+        self.pattern = re.compile(pattern, re.S)
+
+    def extract(self, html):
+        match = self.pattern.search(html)
+        return unescape(match.group(1)).strip() if match else None
+
+
+class SoupExtractor:
+    # Parses only the matching tags (SoupStrainer) when strained, otherwise the whole document
+    def __init__(self, tag='p', class_='price_color', strained=True):
+        self.tag = tag
+        self.class_ = class_
+        self.strainer = SoupStrainer(tag, class_=class_) if strained else None
+
+    def extract(self, html):
+        soup = BeautifulSoup(html, 'html.parser', parse_only=self.strainer)
+        element = soup.find(self.tag, class_=self.class_)
+        return element.text.strip() if element else None
+
+
+# Per-site extractor chains, tried in order; FALLBACK_EXTRACTOR runs when all of them miss
+SITE_EXTRACTORS = {
+    'books.toscrape.com': [RegexExtractor(r'<p class="price_color">([^<]+)</p>')],
+}
+DEFAULT_EXTRACTORS = [
+    RegexExtractor(r'<p\b[^>]*\bclass="[^"]*\bprice_color\b[^"]*"[^>]*>([^<]+)</p>'),
+    SoupExtractor(strained=True),
+]
+FALLBACK_EXTRACTOR = SoupExtractor(strained=False)
+
+
+def extract_price_text(url, html):
+    host = urlsplit(url).hostname or ''
+    for extractor in SITE_EXTRACTORS.get(host, DEFAULT_EXTRACTORS):
+        price_text = extractor.extract(html)
+        if price_text:
+            return price_text
+    return FALLBACK_EXTRACTOR.extract(html)
+
+
+def books_toscrape_listing(url):
+    # Catalogue pages list 20 books each in descending id order: ids 1000-981 on page-1.html, 980-961 on page-2...
+    match = re.match(r'(https?://[^/]+)/catalogue/(?:[^/]+/)*?[^/]+_(\d+)/index\.html$', url)
+    if not match:
+        return None
+    root, product_id = match.group(1), int(match.group(2))
+    return f"{root}/catalogue/page-{max(0, 1000 - product_id) // 20 + 1}.html"
+
+
+# Per-site functions guessing the listing page that shows a product's price (None - fetch the product page)
+LISTING_GUESSERS = {
+    'books.toscrape.com': books_toscrape_listing,
+}
+LISTING_PATTERN = re.compile(r'<h3><a href="([^"]+)"[^>]*>.*?</h3>.*?<p class="price_color">([^<]+)</p>', re.S)
+
+
+def extract_listing_prices(listing_url, html):
+    # Maps absolute product URLs on a listing page to their price texts
+    prices = {urljoin(listing_url, href): unescape(price).strip() for href, price in LISTING_PATTERN.findall(html)}
+    if not prices:
+        soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('article', class_='product_pod'))
+        for article in soup.find_all('article', class_='product_pod'):
+            link, price = article.select_one('h3 a'), article.find('p', class_='price_color')
+            if link and link.get('href') and price:
+                prices[urljoin(listing_url, link['href'])] = price.text.strip()
+    return prices
+
+
+class FetchDeadlineExceeded(requests.RequestException):
+    pass
+
+
+class TokenBucket:
+    # Allows `rate` requests per second on average with bursts of up to `capacity`
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, until):
+        # No tokens before `until` (monotonic time), e.g. a server's Retry-After; then one request, no burst
+        with self._lock:
+            if until > self.paused_until:
+                self.paused_until = until
+                self.tokens = min(1, self.capacity)
+                self.updated = until
+
+    def acquire(self, deadline=None):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class LogHistogram:
+    # Constant-memory histogram with logarithmic buckets (per_octave buckets per doubling above unit)
+    def __init__(self, unit, per_octave=4):
+        self.unit = unit
+        self.per_octave = per_octave
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = 0.0
+
+    def add(self, value):
+        index = 0 if value <= self.unit else int(math.log2(value / self.unit) * self.per_octave) + 1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def upper_bound(self, index):
+        return self.unit * 2 ** (index / self.per_octave)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation (never above the largest value seen)
+        if not self.count:
+            return None
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= q * self.count:
+                return min(self.upper_bound(index), self.maximum)
+        return self.maximum
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.minimum if self.count else None,
+            'max': self.maximum if self.count else None,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': {f"{self.upper_bound(index):.6g}": self.buckets[index] for index in sorted(self.buckets)},
+        }
+
+
+def format_stage(stage, metrics):
+    return f"{stage} p50 {metrics['p50'] * 1000:.1f} ms / p99 {metrics['p99'] * 1000:.1f} ms"
+
+
+class FetchMetrics:
+    # Per-host histograms of fetch pipeline stages (seconds) and response sizes (bytes), plus error counts.
+    # 'connect_ttfb' covers DNS, connect and waiting for headers; 'download' the rest of the body.
+    # Stages without a host (history writes) are kept in a separate section.
+    STAGES = ('connect_ttfb', 'download', 'parse')
+    LOCAL_STAGES = ('write',)
+    UNITS = {'connect_ttfb': 1e-4, 'download': 1e-4, 'parse': 1e-5, 'write': 1e-5, 'size': 64}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._stages = {}
+        self.errors = {}
+
+    def observe(self, host, stage, value):
+        with self._lock:
+            histograms = self._histograms.setdefault(host, {})
+            if stage not in histograms:
+                histograms[stage] = LogHistogram(self.UNITS[stage])
+            histograms[stage].add(value)
+
+    def observe_stage(self, stage, value):
+        with self._lock:
+            if stage not in self._stages:
+                self._stages[stage] = LogHistogram(self.UNITS[stage])
+            self._stages[stage].add(value)
+
+    def error(self, host, kind):
+        with self._lock:
+            errors = self.errors.setdefault(host, {})
+            errors[kind] = errors.get(kind, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            hosts = set(self._histograms) | set(self.errors)
+            return {
+                'hosts': {host: {
+                    **{stage: histogram.to_dict() for stage, histogram in self._histograms.get(host, {}).items()},
+                    'errors': dict(self.errors.get(host, {})),
+                } for host in sorted(hosts)},
+                'stages': {stage: histogram.to_dict() for stage, histogram in self._stages.items()},
+            }
+
+    def summary(self):
+        lines = []
+        snapshot = self.snapshot()
+        for host, metrics in snapshot['hosts'].items():
+            stages = ', '.join(format_stage(stage, metrics[stage]) for stage in self.STAGES if stage in metrics)
+            size = metrics.get('size')
+            sizes = f", średni rozmiar {size['mean'] / 1024:.1f} KB" if size else ''
+            errors = sum(metrics['errors'].values())
+            lines.append(f"{host}: {stages or 'brak pomiarów'}{sizes}, błędy: {errors}")
+        local = ', '.join(format_stage(stage, snapshot['stages'][stage])
+                          for stage in self.LOCAL_STAGES if stage in snapshot['stages'])
+        if local:
+            lines.append(f"etapy lokalne: {local}")
+        return '\n'.join(lines)
+
+    def dump_json(self, filename, extra=None):
+        report = {'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **self.snapshot()}
+        report.update(extra or {})
+        temporary = f"{filename}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+        os.replace(temporary, filename)
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._stages = {}
+            self.errors = {}
+
+
+def timed_extract_price_text(url, html):
+    # extract_price_text plus its duration, so parse time is measured inside parse worker processes too
+    start = time.perf_counter()
+    price_text = extract_price_text(url, html)
+    return price_text, time.perf_counter() - start
+
+
+class PriceFetcher:
+    # Shared keep-alive session: connections to the same shop are reused across products and threads.
+    # Every host gets its own token bucket and concurrency limit; 429/5xx and network errors are retried
+    # with exponential backoff and jitter (honouring Retry-After) as long as the cycle deadline allows.
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, max_workers=16, timeout=(3.05, 10), session=None, rate=5.0, burst=5, per_host=4,
+                 retries=3, backoff=0.5, max_backoff=30.0):
+        self.max_workers = max_workers
+        # Always a (connect, read) pair - requests also accepts a single number for both (None - no limit)
+        self.timeout = tuple(timeout) if isinstance(timeout, (tuple, list)) else (timeout, timeout)
+        self.session = session or requests.Session()
+        if session is None:
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+        self.rate = rate
+        self.burst = burst
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = {'requests': 0, 'not_modified': 0, 'unchanged': 0, 'parses_skipped': 0,
+                      'bytes_downloaded': 0, 'bytes_saved': 0, 'retries': 0, 'errors': 0, 'deadline_exceeded': 0}
+        self._stats_lock = threading.Lock()
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+        self.metrics = FetchMetrics()
+
+    def _host_limits(self, url):
+        host = urlsplit(url).hostname or ''
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = (TokenBucket(self.rate, self.burst), threading.Semaphore(self.per_host))
+            return self._hosts[host]
+
+    def _retry_after(self, response):
+        # Seconds requested by the server (delta or HTTP date), None without a usable header
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    moment = parsedate_to_datetime(retry_after)
+                    return max(0.0, (moment - datetime.datetime.now(moment.tzinfo)).total_seconds())
+                except (TypeError, ValueError):
+                    pass
+        return None
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = self._retry_after(response)
+        if retry_after is not None:
+            return retry_after
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def _deadline_exceeded(self, url):
+        self.record(deadline_exceeded=1)
+        self.metrics.error(urlsplit(url).hostname or '', 'deadline')
+        return FetchDeadlineExceeded(f"Przekroczono limit czasu cyklu dla {url}")
+
+    def get(self, url, headers=None, deadline=None):
+        bucket, semaphore = self._host_limits(url)
+        host = urlsplit(url).hostname or ''
+        attempt = 0
+        while True:
+            if not bucket.acquire(deadline):
+                raise self._deadline_exceeded(url)
+            timeout = self.timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not semaphore.acquire(timeout=remaining):
+                    raise self._deadline_exceeded(url)
+                remaining = deadline - time.monotonic()
+                remaining = max(remaining, 0.001)
+                timeout = tuple(remaining if limit is None else min(limit, remaining) for limit in self.timeout)
+            else:
+                semaphore.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, timeout=timeout, headers=headers)
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as exception:
+                response, error = None, exception
+            finally:
+                semaphore.release()
+            self._observe(host, response, time.perf_counter() - start, error)
+
+            if error is None and response.status_code not in self.RETRY_STATUSES:
+                return response
+            # Retry-After holds back every worker using this host, not only this request; a wait
+            # longer than max_backoff is not retried here - the response goes back to the caller
+            retry_after = self._retry_after(response)
+            if retry_after is not None:
+                bucket.pause(time.monotonic() + retry_after)
+            if attempt >= self.retries or (retry_after is not None and retry_after > self.max_backoff):
+                self.record(errors=1)
+                if error is not None:
+                    raise error
+                return response
+            delay = self._retry_delay(attempt, response)
+            if deadline is not None and time.monotonic() + delay > deadline:
+                raise self._deadline_exceeded(url)
+            self.record(retries=1)
+            time.sleep(delay)
+            attempt += 1
+
+    def _observe(self, host, response, elapsed, error):
+        if error is not None:
+            self.metrics.error(host, type(error).__name__)
+            return
+        # response.elapsed ends when the headers are parsed; the remaining time is the body download
+        headers_elapsed = getattr(response, 'elapsed', None)
+        ttfb = min(elapsed, headers_elapsed.total_seconds()) if headers_elapsed is not None else elapsed
+        self.metrics.observe(host, 'connect_ttfb', ttfb)
+        self.metrics.observe(host, 'download', elapsed - ttfb)
+        self.metrics.observe(host, 'size', len(response.content))
+        if response.status_code >= 400:
+            self.metrics.error(host, f"HTTP {response.status_code}")
+
+    def record(self, **counts):
+        with self._stats_lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
+    def close(self):
+        self.session.close()
+
+
+class PriceHistory:
+    # Append-only price log: one row per observation, indexed by (product, timestamp)
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        if path != ':memory:':
+            self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS prices (
+                product TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                price REAL NOT NULL,
+                url TEXT
+            );
+            CREATE INDEX IF NOT EXISTS prices_product_timestamp ON prices (product, timestamp);
+            CREATE INDEX IF NOT EXISTS prices_timestamp ON prices (timestamp);
+            CREATE TABLE IF NOT EXISTS imports (
+                source TEXT PRIMARY KEY,
+                timestamp TEXT NOT NULL
+            );
+        """)
+
+    def append(self, products, timestamp=None):
+        timestamp = timestamp or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = [(product.name, timestamp, product.current_price, product.url) for product in products]
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT INTO prices VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def query(self, product=None, start=None, end=None):
+        conditions, parameters = [], []
+        if product is not None:
+            conditions.append('product = ?')
+            parameters.append(product)
+        if start is not None:
+            conditions.append('timestamp >= ?')
+            parameters.append(start)
+        if end is not None:
+            conditions.append('timestamp <= ?')
+            parameters.append(end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._lock:
+            return self._connection.execute(
+                f'SELECT product, timestamp, price FROM prices {where} ORDER BY product, timestamp', parameters
+            ).fetchall()
+
+    def import_legacy_csv(self, filename):
+        # Old format: name, "[prices]", "[timestamps]", url - parsed safely instead of eval.
+        # Every file is imported once (marker in 'imports'); rows already in the store are skipped,
+        # so databases migrated before the marker existed do not get duplicates.
+        source = os.path.basename(filename)
+        with self._lock:
+            if self._connection.execute('SELECT 1 FROM imports WHERE source = ?', (source,)).fetchone():
+                return 0
+        rows = []
+        with open(filename, 'r', newline='') as csvfile:
+            for row in csv.reader(csvfile):
+                name, prices, timestamps, url = row[0], ast.literal_eval(row[1]), ast.literal_eval(row[2]), row[3]
+                rows.extend((name, timestamp, float(price), url) for price, timestamp in zip(prices, timestamps))
+        with self._lock, self._connection:
+            before = self._connection.total_changes
+            self._connection.executemany(
+                'INSERT INTO prices SELECT ?, ?, ?, ? WHERE NOT EXISTS '
+                '(SELECT 1 FROM prices WHERE product = ? AND timestamp = ? AND price = ?)',
+                [row + row[:3] for row in rows]
+            )
+            imported = self._connection.total_changes - before
+            self._connection.execute('INSERT INTO imports VALUES (?, ?)',
+                                     (source, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        return imported
+
+    def close(self):
+        self._connection.close()
+
+
+class PollingScheduler:
+    # Priority queue of (next due time, product) served by a worker pool; the interval of every product
+    # adapts to how often its price actually changes, within [min_interval, max_interval]
+    def __init__(self, monitor, filename, interval=60, min_interval=None, max_interval=None, jitter=0.1,
+                 speedup=0.5, slowdown=1.5, poll_budget=None):
+        self.monitor = monitor
+        self.filename = filename
+        self.interval = interval
+        self.min_interval = min_interval if min_interval is not None else interval / 4
+        self.max_interval = max_interval if max_interval is not None else interval * 16
+        self.jitter = jitter
+        # Time limit of a single poll (retries included), by default the base interval
+        self.poll_budget = poll_budget if poll_budget is not None else interval
+        self.speedup = speedup
+        self.slowdown = slowdown
+        self.intervals = {}
+        self.polls = {}
+        self._heap = []
+        self._counter = 0
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._synced_at = None
+
+    def start(self):
+        # Opened (and a legacy CSV migrated) here, before any worker can write to it
+        self.monitor.history(self.filename)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _schedule(self, product, delay):
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        self._counter += 1
+        heapq.heappush(self._heap, (time.monotonic() + delay, self._counter, product))
+        self._condition.notify_all()
+
+    def _sync_products(self):
+        # New products are polled right away (spread by jitter), removed ones are dropped when they come due
+        current = set(self.monitor.products)
+        for product in self.monitor.products:
+            if product not in self.intervals:
+                self.intervals[product] = self.interval
+                self.polls[product] = 0
+                self._schedule(product, self.jitter * self.interval)
+        for product in [product for product in self.intervals if product not in current]:
+            del self.intervals[product]
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.monitor.fetcher.max_workers) as executor:
+            while True:
+                with self._condition:
+                    if not self._running:
+                        break
+                    if self._synced_at is None or time.monotonic() - self._synced_at >= 1.0:
+                        self._sync_products()
+                        self._synced_at = time.monotonic()
+                    wait = self._heap[0][0] - time.monotonic() if self._heap else 1.0
+                    if wait > 0:
+                        self._condition.wait(min(wait, 1.0))
+                        continue
+                    _, _, product = heapq.heappop(self._heap)
+                    if product not in self.intervals:
+                        continue
+                executor.submit(self._poll, product)
+
+    def _poll(self, product):
+        old_price = product.current_price
+        try:
+            product.update_price(self.monitor.fetcher, time.monotonic() + self.poll_budget)
+            start = time.perf_counter()
+            self.monitor.history(self.filename).append([product])
+            self.monitor.metrics.observe_stage('write', time.perf_counter() - start)
+        except Exception as error:
+            print(f"Błąd aktualizacji produktu {product.name}: {error}")
+        with self._condition:
+            self.polls[product] += 1
+            if product not in self.intervals or not self._running:
+                return
+            if product.current_price != old_price:
+                interval = max(self.min_interval, self.intervals[product] * self.speedup)
+            else:
+                interval = min(self.max_interval, self.intervals[product] * self.slowdown)
+            self.intervals[product] = interval
+            self._schedule(product, interval)
+
+
 class Product:
     def __init__(self, name, url='', current_price = 0.0):
         self.name = name
         self.url = url
+        # Callbacks (product, old_price) run on every price change, e.g. to keep a catalogue index in sync
+        self.price_listeners = []
         self.current_price = current_price
-    def update_price(self):
-        response = requests.get(self.url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        price_element = soup.find('p', class_='price_color')
-        if price_element:
-            # Extract the price text and strip out any non-numeric characters
-            price_text = price_element.text.strip()
+        # Validators of the last parsed page, used for conditional requests
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self.content_length = 0
+        # Validators of a fetched page waiting for its parse; saved by commit_page only once the parse succeeded
+        self._pending_page = None
+    @property
+    def current_price(self):
+        return self._current_price
 
+    @current_price.setter
+    def current_price(self, price):
+        old_price = getattr(self, '_current_price', None)
+        self._current_price = price
+        if old_price != price:
+            for listener in self.price_listeners:
+                listener(self, old_price)
 
-            price_number = re.sub(r'[^\d.,]', '', price_text)  # Regex
+    def update_price(self, fetcher=None, deadline=None):
+        html = self.fetch_page(fetcher, deadline)
+        if html is not None:
+            price_text, elapsed = timed_extract_price_text(self.url, html)
+            self.commit_page()
+            if fetcher is not None:
+                fetcher.metrics.observe(urlsplit(self.url).hostname or '', 'parse', elapsed)
+            self.apply_price_text(price_text)
 
-            price_number = price_number.replace(',', '.')
+    def fetch_page(self, fetcher=None, deadline=None):
+        # Returns the page to parse, or None when it failed or did not change since the last parse
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        try:
+            if fetcher is not None:
+                response = fetcher.get(self.url, headers=headers or None, deadline=deadline)
+            else:
+                response = requests.get(self.url, timeout=(3.05, 10), headers=headers or None)
+        except requests.RequestException as error:
+            print(f"Nie udało się pobrać strony produktu {self.name}: {error}")
+            return None
 
-            try:
-                price = float(price_number)
-                if '£' in price_text:
-                    price *= 5
-                elif 'PLN' in price_text:
-                    pass
-                elif 'USD' in price_text or '$' in price_text:
-                    price *= 4
-                elif 'EUR' in price_text or '€' in price_text:
-                    price *= 4.4
-                else:
-                    print('Nie rozpoznano waluty')
-                    price = 0
+        if response.status_code == 304:
+            # Page not modified since the last poll - nothing downloaded, nothing to parse
+            if fetcher is not None:
+                fetcher.record(requests=1, not_modified=1, parses_skipped=1, bytes_saved=self.content_length)
+            return None
+        if response.status_code >= 400:
+            print(f"Serwer zwrócił błąd {response.status_code} dla produktu {self.name}.")
+            return None
+        content_hash = hashlib.sha1(response.content).hexdigest()
+        unchanged = content_hash == self.content_hash
+        if fetcher is not None:
+            fetcher.record(requests=1, unchanged=int(unchanged), parses_skipped=int(unchanged),
+                           bytes_downloaded=len(response.content))
+        if unchanged:
+            self.etag = response.headers.get('ETag')
+            self.last_modified = response.headers.get('Last-Modified')
+            return None
+        self._pending_page = (content_hash, len(response.content),
+                              response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response.text
+
+    def commit_page(self):
+        # Called after the page returned by fetch_page was parsed; a lost parse leaves the old validators,
+        # so the page is downloaded and parsed again on the next poll
+        if self._pending_page is not None:
+            self.content_hash, self.content_length, self.etag, self.last_modified = self._pending_page
+            self._pending_page = None
 
+    def apply_price_text(self, price_text):
+        if price_text:
+            try:
+                price = parse_price(price_text)
                 self.current_price = price
 
                 # For debugging: print the extracted price text
@@ -50,16 +684,153 @@ class Product:
 
 
 
+class ProductCatalogue:
+    # Indexed product list: exact name map (duplicate detection), n-gram index for substring search
+    # and a sorted (price, sequence) index kept in sync through Product.price_listeners
+    NGRAM = 3
+
+    def __init__(self, products=()):
+        self._lock = threading.RLock()
+        self._sequence = itertools.count()
+        self._products = {}
+        self._by_name = {}
+        self._ngrams = {}
+        self._price_keys = []
+        self._price_products = []
+        for product in products:
+            self._index(product)
+        # Initial products are sorted once instead of being inserted one by one
+        order = sorted(self._products.items(), key=lambda item: (item[0].current_price, item[1]))
+        self._price_keys = [(product.current_price, sequence) for product, sequence in order]
+        self._price_products = [product for product, _ in order]
+
+    def _grams(self, text):
+        return {text[i:i + self.NGRAM] for i in range(len(text) - self.NGRAM + 1)}
+
+    def _index(self, product):
+        key = product.name.lower()
+        if key in self._by_name:
+            raise ValueError(f"Produkt {product.name} jest już monitorowany.")
+        sequence = next(self._sequence)
+        self._products[product] = sequence
+        self._by_name[key] = product
+        for gram in self._grams(key):
+            self._ngrams.setdefault(gram, set()).add(product)
+        product.price_listeners.append(self._price_changed)
+        return sequence
+
+    def append(self, product):
+        with self._lock:
+            sequence = self._index(product)
+            self._insert_price(product, product.current_price, sequence)
+
+    def remove(self, product):
+        with self._lock:
+            sequence = self._products.pop(product)
+            key = product.name.lower()
+            del self._by_name[key]
+            for gram in self._grams(key):
+                self._ngrams[gram].discard(product)
+                if not self._ngrams[gram]:
+                    del self._ngrams[gram]
+            self._remove_price(product.current_price, sequence)
+            product.price_listeners.remove(self._price_changed)
+
+    def clear(self):
+        for product in list(self):
+            self.remove(product)
+
+    def _insert_price(self, product, price, sequence):
+        index = bisect.bisect_left(self._price_keys, (price, sequence))
+        self._price_keys.insert(index, (price, sequence))
+        self._price_products.insert(index, product)
+
+    def _remove_price(self, price, sequence):
+        index = bisect.bisect_left(self._price_keys, (price, sequence))
+        del self._price_keys[index]
+        del self._price_products[index]
+
+    def _price_changed(self, product, old_price):
+        with self._lock:
+            sequence = self._products.get(product)
+            if sequence is not None:
+                self._remove_price(old_price, sequence)
+                self._insert_price(product, product.current_price, sequence)
+
+    def get(self, name):
+        return self._by_name.get(name.lower())
+
+    def search(self, text):
+        # Products whose name contains text (case-insensitive), in insertion order
+        text = text.lower()
+        with self._lock:
+            grams = self._grams(text)
+            if grams:
+                candidates = set.intersection(*sorted((self._ngrams.get(gram, set()) for gram in grams), key=len))
+            else:
+                candidates = self._products
+            matches = [product for product in candidates if text in product.name.lower()]
+            return sorted(matches, key=self._products.__getitem__)
+
+    def cheapest(self, k=1):
+        with self._lock:
+            return self._price_products[:k]
+
+    def price_range(self, low=None, high=None):
+        with self._lock:
+            start = 0 if low is None else bisect.bisect_left(self._price_keys, (low, -1))
+            end = len(self._price_keys) if high is None else bisect.bisect_right(self._price_keys, (high, float('inf')))
+            return self._price_products[start:end]
+
+    def __len__(self):
+        return len(self._products)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._products))
+
+    def __contains__(self, product):
+        return product in self._products
+
+    def __getitem__(self, index):
+        with self._lock:
+            return list(self._products)[index]
+
+
 class PriceMonitor:
-    def __init__(self, products = []):
-        self.products = products
+    def __init__(self, products = None, max_workers=16, timeout=(3.05, 10), cycle_budget=300, parse_processes=None,
+                 queue_size=64):
+        self.catalogue = ProductCatalogue(products or [])
+        self.fetcher = PriceFetcher(max_workers=max_workers, timeout=timeout)
+        self.cycle_budget = cycle_budget
+        # With parse_processes set, pages are parsed in a process pool fed through a bounded queue
+        self.parse_processes = parse_processes
+        self.queue_size = queue_size
+        self._parse_executor = None
+        self._histories = {}
+        self._histories_lock = threading.Lock()
+        # Product URL -> listing page that showed its price last time, None if it must be fetched directly
+        self.listing_pages = {}
+    @property
+    def products(self):
+        return self.catalogue
+
+    @products.setter
+    def products(self, products):
+        products = list(products)
+        self.catalogue.clear()
+        self.catalogue = ProductCatalogue(products)
+
     def add_product(self, name, url):
+        if self.catalogue.get(name) is not None:
+            print("Produkt o tej nazwie jest już monitorowany.")
+            return
         product = Product(name,url)
-        product.update_price()
+        product.update_price(self.fetcher)
         self.products.append(product)
         print('Pomyślnie dodano produkt.')
     def remove_product(self, name):
-        matching_products = [product for product in self.products if name.lower() in product.name.lower()]
+        matching_products = self.catalogue.search(name)
 
         if not matching_products:
             print("Nie odnaleziono produktu.")
@@ -80,19 +851,172 @@ class PriceMonitor:
                 print("Wybrano niepoprawną opcję.")
         except ValueError:
             print("Błąd wprowadzono inny znak niż cyfra.")
-    def update_all_prices(self):
+    def update_all_prices(self, budget=None, bulk=False):
         if len(self.products) < 1:
             print('Nie odnaleziono produktów do zaktualizowania cen.')
+        elif bulk:
+            self.harvest_prices(budget)
         else:
-            for product in self.products:
-                product.update_price()
+            # Fetch concurrently over the shared session; the cycle takes about as long as the slowest requests.
+            # With a time budget (seconds) every fetch still pending at the deadline is abandoned.
+            budget = budget if budget is not None else self.cycle_budget
+            deadline = time.monotonic() + budget if budget is not None else None
+            if self.parse_processes:
+                self._update_with_pipeline(deadline)
+                return
+            workers = min(self.fetcher.max_workers, len(self.products))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda product: product.update_price(self.fetcher, deadline), self.products))
+
+    def _parse_pool(self):
+        if self._parse_executor is None:
+            # Workers start on the first submit, while the fetch threads are running
+            self._parse_executor = ProcessPoolExecutor(max_workers=self.parse_processes,
+                                                       mp_context=pool_context(threads_running=True))
+        return self._parse_executor
+
+    def _update_with_pipeline(self, deadline=None):
+        # Fetch threads -> bounded queue -> dispatcher -> parse processes. When the parsers fall behind,
+        # the in-flight limit stops the dispatcher, the queue fills up and the fetch threads block on put.
+        pages = queue.Queue(maxsize=self.queue_size)
+        in_flight = threading.Semaphore(self.queue_size)
+        pool = self._parse_pool()
+        parsed = []
+        errors = []
+        finished = object()
+
+        def fetch(product):
+            html = product.fetch_page(self.fetcher, deadline)
+            if html is None:
+                return
+            # Never block past the cycle deadline, or forever on a dispatcher that has stopped
+            while dispatcher.is_alive():
+                timeout = 1.0 if deadline is None else deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pages.put((product, html), timeout=min(timeout, 1.0))
+                    return
+                except queue.Full:
+                    continue
+            print(f"Pominięto parsowanie strony produktu {product.name}.")
+
+        def dispatch():
+            done = False
+            try:
+                while True:
+                    item = pages.get()
+                    if item is finished:
+                        done = True
+                        return
+                    if errors:
+                        # The pool is unusable - keep draining so the fetch threads are not blocked
+                        continue
+                    product, html = item
+                    in_flight.acquire()
+                    try:
+                        future = pool.submit(timed_extract_price_text, product.url, html)
+                    except Exception as error:
+                        in_flight.release()
+                        errors.append(error)
+                        continue
+                    future.add_done_callback(lambda _: in_flight.release())
+                    parsed.append((product, future))
+            finally:
+                while not done:
+                    done = pages.get() is finished
+
+        dispatcher = threading.Thread(target=dispatch, daemon=True)
+        dispatcher.start()
+        try:
+            workers = min(self.fetcher.max_workers, len(self.products))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(fetch, self.products))
+        finally:
+            pages.put(finished)
+            dispatcher.join()
+        wait([future for _, future in parsed])
+        for product, future in parsed:
+            try:
+                price_text, elapsed = future.result()
+            except Exception as error:
+                errors.append(error)
+                print(f"Błąd parsowania strony produktu {product.name}: {error}")
+                continue
+            product.commit_page()
+            self.metrics.observe(urlsplit(product.url).hostname or '', 'parse', elapsed)
+            product.apply_price_text(price_text)
+        if any(isinstance(error, BrokenProcessPool) for error in errors):
+            # A worker died (e.g. killed for memory) - the next cycle starts a fresh pool
+            print("Pula procesów parsujących uległa awarii, zostanie utworzona ponownie.")
+            if self._parse_executor is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._parse_executor = None
+
+    def close(self):
+        if self._parse_executor is not None:
+            self._parse_executor.shutdown()
+            self._parse_executor = None
+        with self._histories_lock:
+            for history in self._histories.values():
+                history.close()
+            self._histories = {}
+        self.fetcher.close()
+
+    def harvest_prices(self, budget=None):
+        # Bulk mode: one listing page request updates every monitored product shown on it;
+        # products without a known listing (or missing from it) fall back to their own page
+        budget = budget if budget is not None else self.cycle_budget
+        deadline = time.monotonic() + budget if budget is not None else None
+        listings = {}
+        remaining = []
+        for product in self.products:
+            if product.url in self.listing_pages:
+                listing = self.listing_pages[product.url]
+            else:
+                guesser = LISTING_GUESSERS.get(urlsplit(product.url).hostname or '')
+                listing = guesser(product.url) if guesser else None
+            if listing:
+                listings.setdefault(listing, []).append(product)
+            else:
+                remaining.append(product)
+
+        def harvest(listing):
+            try:
+                response = self.fetcher.get(listing, deadline=deadline)
+            except requests.RequestException as error:
+                print(f"Nie udało się pobrać strony katalogu {listing}: {error}")
+                return listings[listing]
+            if response.status_code >= 400:
+                return listings[listing]
+            start = time.perf_counter()
+            prices = extract_listing_prices(listing, response.text)
+            self.metrics.observe(urlsplit(listing).hostname or '', 'parse', time.perf_counter() - start)
+            self.listing_pages.update(dict.fromkeys(prices, listing))
+            missing = []
+            for product in listings[listing]:
+                try:
+                    product.current_price = parse_price(prices[product.url])
+                except (KeyError, ValueError):
+                    # Not on the guessed page - fetch it directly until it shows up on another listing
+                    self.listing_pages[product.url] = None
+                    missing.append(product)
+            return missing
+
+        workers = min(self.fetcher.max_workers, max(1, len(listings)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for missing in executor.map(harvest, list(listings)):
+                remaining.extend(missing)
+            list(executor.map(lambda product: product.update_price(self.fetcher, deadline), remaining))
+        print(f"Zaktualizowano ceny {len(self.products) - len(remaining)} produktów z {len(listings)} stron katalogu, "
+              f"{len(remaining)} pobrano osobno.")
 
     def get_cheapest_product(self):
         if not self.products:
             print("Nie znaleziono żadnego produktu w bazie.")
             return None
 
-        cheapest_product = min(self.products, key=lambda product: product.current_price)
+        cheapest_product = self.catalogue.cheapest(1)[0]
         print(f"Najtańszy produkt to {cheapest_product.name} kosztujący {cheapest_product.current_price} PLN")
         return cheapest_product
 
@@ -109,7 +1033,10 @@ class PriceMonitor:
             for row in reader:
                 name, price, url = row  # Expect each row to have name, price, and url
                 product = Product(name=name, url=url, current_price=float(price))
-                self.products.append(product)
+                try:
+                    self.products.append(product)
+                except ValueError as error:
+                    print(error)
 
     def display_all_products(self):
         if not self.products:
@@ -118,57 +1045,60 @@ class PriceMonitor:
             print("Lista produktów i ich cen:")
             for product in self.products:
                 print(f"Produkt: {product.name}, Cena: {product.current_price}")
-    def automatic_price_update(self, filename, interval=60):
-        def update_task():
-            while True:
-                self.update_all_prices()
-                self.append_prices_to_csv(filename)
-                time.sleep(interval)
-        update_thread  = threading.Thread(target=update_task, daemon=True)
-        update_thread.start()
+    def automatic_price_update(self, filename, interval=60, min_interval=None, max_interval=None, jitter=0.1,
+                               poll_budget=None):
+        # Each product gets its own polling interval, shortened when its price changes and stretched when it does not
+        scheduler = PollingScheduler(self, filename, interval, min_interval, max_interval, jitter,
+                                     poll_budget=poll_budget)
+        scheduler.start()
+        return scheduler
 
-    import csv
-    import datetime
+    @property
+    def metrics(self):
+        return self.fetcher.metrics
 
-    def append_prices_to_csv(self, filename):
-        # Load existing data from CSV file if it exists
-        existing_data = {}
-        try:
-            with open(filename, 'r', newline='') as csvfile:
-                reader = csv.reader(csvfile)
-                for row in reader:
-                    name, prices, timestamps, url = row[0], eval(row[1]), eval(row[2]), row[3]
-                    existing_data[name] = (prices, timestamps, url)
-        except FileNotFoundError:
-            pass
-
-        # Update prices for monitored products and add a new timestamp
-        for product in self.products:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            if product.name in existing_data:
-                prices, timestamps, url = existing_data[product.name]
-                prices.append(product.current_price)
-                timestamps.append(timestamp)
-                existing_data[product.name] = (prices, timestamps, product.url)
-            else:
-                existing_data[product.name] = ([product.current_price], [timestamp], product.url)
+    def start_metrics_dump(self, filename, interval=60):
+        # Writes the metrics snapshot and fetch counters to a JSON file every interval seconds
+        def dump_task():
+            while True:
+                time.sleep(interval)
+                self.metrics.dump_json(filename, {'counters': dict(self.fetcher.stats)})
+        dump_thread = threading.Thread(target=dump_task, daemon=True)
+        dump_thread.start()
 
-        # Write data back to CSV
-        with open(filename, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            for name, (prices, timestamps, url) in existing_data.items():
-                writer.writerow([name, prices, timestamps, url])
+    def history(self, filename):
+        # History lives in SQLite; a legacy CSV next to it (same name, .csv) is imported once,
+        # whichever of the two names is passed
+        root, extension = os.path.splitext(filename)
+        legacy = root + '.csv'
+        if extension == '.csv':
+            filename = root + '.db'
+        # Held across opening and the import, so parallel first polls open and migrate it once
+        with self._histories_lock:
+            if filename not in self._histories:
+                history = PriceHistory(filename)
+                if os.path.exists(legacy):
+                    count = history.import_legacy_csv(legacy)
+                    if count:
+                        print(f"Zaimportowano {count} pomiarów z pliku {legacy} do {filename}")
+                self._histories[filename] = history
+            return self._histories[filename]
 
-        print(f"Ceny zostały zaktualizowane w pliku: {filename}")
+    def append_prices_to_history(self, filename):
+        # Only the new observations are written - the tick cost does not grow with the history
+        history = self.history(filename)
+        start = time.perf_counter()
+        history.append(self.products)
+        self.metrics.observe_stage('write', time.perf_counter() - start)
+        print(f"Ceny zostały zapisane w historii: {history.path}")
 
-    def plot_price_trends(self, filename, combine = False):
-        # Load data from CSV file
+    def plot_price_trends(self, filename, combine = False, start=None, end=None):
+        # Load the requested time range from the history (indexed by product and timestamp)
         products_data = {}
-        with open(filename, 'r', newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            for row in reader:
-                name, prices, timestamps, url = row[0], eval(row[1]), eval(row[2]), row[3]
-                products_data[name] = (prices, timestamps)
+        for name, timestamp, price in self.history(filename).query(start=start, end=end):
+            prices, timestamps = products_data.setdefault(name, ([], []))
+            prices.append(price)
+            timestamps.append(timestamp)
 
         # Plot each product's price trend
         if not combine:
@@ -211,6 +1141,7 @@ def main():
 
     monitor.update_all_prices()
     monitor.automatic_price_update(filename='ceny2.csv',interval=60)
+    monitor.start_metrics_dump(filename='statystyki_pobierania.json', interval=300)
     print("Witaj w systemie monitorowania cen!")
 
     while True:
@@ -223,6 +1154,8 @@ def main():
         print("7. Wyjdź")
         print("8. Wyświetl wszystkie produkty")
         print("9. Wyświetl wykres cen.")
+        print("10. Zaktualizuj ceny hurtowo (strony katalogu)")
+        print("11. Wyświetl statystyki pobierania")
 
         choice = input("Wybierz opcję: ")
 
@@ -249,13 +1182,20 @@ def main():
         elif choice == "8":
             monitor.display_all_products()
         elif choice == "9":
-            filename = input("Podaj nazwe pliku csv z ktorego chcesz stworzyc wykres cenowy. ")
+            filename = input("Podaj nazwe pliku historii (.db lub dawny .csv) z ktorego chcesz stworzyc wykres cenowy. ")
             comb = input("Czy wyswietlic wykres kazdego produktu osobno?\n[1]Tak \n[2]Nie ")
             if comb == 1:
                 combbool = False
             else:
                 combbool = True
             monitor.plot_price_trends(filename = filename, combine = combbool)
+        elif choice == "10":
+            monitor.update_all_prices(bulk=True)
+        elif choice == "11":
+            print(monitor.metrics.summary() or "Brak pomiarów.")
+            filename = input("Podaj nazwę pliku JSON do zapisania statystyk (puste - pomiń): ")
+            if filename:
+                monitor.metrics.dump_json(filename, {'counters': dict(monitor.fetcher.stats)})
         else:
             print("Nieprawidłowy wybór. Spróbuj ponownie.")
 
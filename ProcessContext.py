@@ -0,0 +1,27 @@
+import multiprocessing
+import sys
+import threading
+
+
+def pool_context(threads_running=False):
+    """
+    Wybiera metodę startu procesów roboczych puli, wspólną dla całego projektu.
+
+    fork (współdzielenie pamięci bez kopiowania) jest używany tylko na Linuksie i tylko wtedy, gdy
+    proces nie ma innych wątków - fork wielowątkowego procesu może zakleszczyć dziecko na
+    skopiowanej blokadzie, a na macOS fork jest niebezpieczny także bez wątków. W pozostałych
+    przypadkach używany jest forkserver, a gdy go brak (Windows) - spawn. Przy forkserver i spawn
+    argumenty procesów roboczych muszą dać się serializować (pickle).
+
+    Args:
+        threads_running (bool): Czy w chwili tworzenia procesów będą działać inne wątki
+            (np. wątki pobierające uruchamiane po utworzeniu puli). Domyślnie False.
+
+    Returns:
+        multiprocessing.context.BaseContext: Kontekst do przekazania jako mp_context.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    if (sys.platform.startswith('linux') and 'fork' in methods
+            and not threads_running and threading.active_count() == 1):
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
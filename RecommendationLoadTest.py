@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+
+async def _client(host, port, user_ids, top_n, genre, latencies, errors):
+    """Wysyła zapytania po kolei przez jedno połączenie keep-alive."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for user_id in user_ids:
+            query = f"/recommend?user_id={user_id}&top_n={top_n}" + (f"&genre={genre}" if genre else "")
+            start = time.perf_counter()
+            writer.write(f"GET {query} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('latin-1'))
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, user_ids, concurrency=64, top_n=10, genre=None):
+    """
+    Rozdziela zapytania między równoległych klientów i mierzy przepustowość serwera.
+
+    Args:
+        host (str): Adres serwera.
+        port (int): Port serwera.
+        user_ids (list): ID użytkowników kolejnych zapytań.
+        concurrency (int): Liczba równoległych połączeń. Domyślnie 64.
+        top_n (int): Liczba rekomendacji na zapytanie. Domyślnie 10.
+        genre (str): Gatunki do filtrowania wyników. Domyślnie None.
+
+    Returns:
+        dict: Liczba zapytań i błędów, przepustowość (zapytania/s) i opóźnienia p50/p99 w ms.
+    """
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _client(host, port, user_ids[client::concurrency], top_n, genre, latencies, errors)
+        for client in range(min(concurrency, len(user_ids)))
+    ))
+    elapsed = time.perf_counter() - start
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'concurrency': concurrency,
+        'elapsed_s': elapsed,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'latency_p50_ms': float(np.percentile(latencies, 50)) if latencies else None,
+        'latency_p99_ms': float(np.percentile(latencies, 99)) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generator obciążenia dla RecommendationServer.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64],
+                        help="Liczby równoległych połączeń (kilka wartości daje krzywą przepustowości).")
+    parser.add_argument('--max-user', type=int, default=6040, help="Zapytania losują ID z zakresu 1..max-user.")
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--genre', default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="Plik JSON z wynikami (domyślnie wypisanie na ekran).")
+    args = parser.parse_args()
+
+    user_ids = np.random.default_rng(args.seed).integers(1, args.max_user + 1, size=args.requests).tolist()
+    results = []
+    for concurrency in args.concurrency:
+        result = asyncio.run(run_load(args.host, args.port, user_ids, concurrency, args.top_n, args.genre))
+        print(f"{concurrency} połączeń: {result['throughput_rps']:.0f} zapytań/s, "
+              f"p50 {result['latency_p50_ms']:.2f} ms, p99 {result['latency_p99_ms']:.2f} ms")
+        results.append(result)
+
+    report = {'config': vars(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
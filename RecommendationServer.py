@@ -0,0 +1,278 @@
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from MovieReccomendationsSystem import MovieRecommender
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class MicroBatcher:
+    """
+    Łączy równoległe zapytania o rekomendacje w jedno wywołanie recommend_batch.
+
+    Zapytania, które nadejdą w ciągu max_delay_ms od pierwszego oczekującego (lub do max_batch
+    zapytań), są grupowane po filtrze gatunków i oceniane razem w wątku roboczym, dzięki czemu
+    pętla zdarzeń nie jest blokowana obliczeniami.
+
+    Attributes:
+        recommender (MovieRecommender): Model z obliczonymi podobieństwami.
+        max_delay_ms (float): Maksymalny czas oczekiwania na kolejne zapytania.
+        max_batch (int): Maksymalna liczba zapytań w jednej porcji.
+        batches (int): Liczba wykonanych porcji.
+        requests (int): Liczba obsłużonych zapytań.
+    """
+    def __init__(self, recommender, max_delay_ms=5, max_batch=256):
+        """
+        Args:
+            recommender (MovieRecommender): Model z obliczonymi podobieństwami.
+            max_delay_ms (float): Maksymalny czas oczekiwania na kolejne zapytania. Domyślnie 5.
+            max_batch (int): Maksymalna liczba zapytań w jednej porcji. Domyślnie 256.
+        """
+        self.recommender = recommender
+        self.max_delay_ms = max_delay_ms
+        self.max_batch = max_batch
+        self.batches = 0
+        self.requests = 0
+        self._queue = None
+        self._worker = None
+        # jeden wątek - model nie jest współdzielony przez równoległe obliczenia
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def start(self):
+        """Uruchamia zadanie grupujące zapytania (wymaga działającej pętli zdarzeń)."""
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Zatrzymuje zadanie grupujące i wątek roboczy."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    async def recommend(self, user_id, top_n=5, genre=None):
+        """
+        Zwraca rekomendacje dla użytkownika, oceniając je razem z innymi oczekującymi zapytaniami.
+
+        Args:
+            user_id (int): ID użytkownika.
+            top_n (int): Liczba rekomendacji. Domyślnie 5.
+            genre (str): Gatunki do filtrowania wyników. Domyślnie None.
+
+        Returns:
+            list: Słowniki z kluczami movieId, title, genres, score.
+
+        Raises:
+            ValueError: Gdy użytkownik nie istnieje.
+        """
+        if user_id not in self.recommender.user_index:
+            raise ValueError("User ID not found")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((user_id, top_n, genre or None, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay_ms / 1000
+            while len(pending) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            groups = {}
+            for request in pending:
+                groups.setdefault(request[2], []).append(request)
+            for genre, requests in groups.items():
+                try:
+                    results = await loop.run_in_executor(self._executor, self._score, requests, genre)
+                except Exception as error:
+                    for *_, future in requests:
+                        if not future.done():
+                            future.set_exception(error)
+                    continue
+                for (_, _, _, future), result in zip(requests, results):
+                    if not future.done():
+                        future.set_result(result)
+            self.batches += 1
+            self.requests += len(pending)
+
+    def _score(self, requests, genre):
+        """Ocenia porcję zapytań jednym wywołaniem recommend_batch (w wątku roboczym)."""
+        recommender = self.recommender
+        user_ids = list(dict.fromkeys(user_id for user_id, *_ in requests))
+        top_n = max(top_n for _, top_n, *_ in requests)
+        batch = recommender.recommend_batch(user_ids, top_n=top_n, genre=genre)
+
+        columns = np.array([recommender.movie_index[movie_id] for movie_id in batch['movieId'].tolist()],
+                           dtype=np.int64)
+        movie_rows = recommender.movie_rows[columns] if len(columns) else columns
+        by_user = {}
+        for user_id, movie_id, movie_row, score in zip(batch['userId'].tolist(), batch['movieId'].tolist(),
+                                                       movie_rows.tolist(), batch['score'].tolist()):
+            by_user.setdefault(user_id, []).append({
+                'movieId': movie_id,
+                'title': recommender.movie_titles[movie_row] if movie_row >= 0 else None,
+                'genres': recommender.movie_genres[movie_row] if movie_row >= 0 else '',
+                'score': score,
+            })
+        return [by_user.get(user_id, [])[:top_n] for user_id, top_n, *_ in requests]
+
+    def stats(self):
+        """Zwraca liczbę zapytań, porcji i średni rozmiar porcji."""
+        return {'requests': self.requests, 'batches': self.batches,
+                'mean_batch_size': self.requests / self.batches if self.batches else 0.0}
+
+
+class RecommendationServer:
+    """
+    Lokalny serwer HTTP/JSON (asyncio) udostępniający rekomendacje jednego, ciepłego modelu.
+
+    Endpointy:
+        GET /recommend?user_id=1&top_n=5&genre=Comedy - rekomendacje dla użytkownika,
+        GET /stats - statystyki grupowania zapytań i pamięci podręcznej modelu,
+        GET /health - sprawdzenie działania serwera.
+    """
+    def __init__(self, recommender, host='127.0.0.1', port=8080, max_delay_ms=5, max_batch=256):
+        """
+        Args:
+            recommender (MovieRecommender): Model z obliczonymi podobieństwami.
+            host (str): Adres nasłuchiwania. Domyślnie '127.0.0.1'.
+            port (int): Port nasłuchiwania (0 - dowolny wolny). Domyślnie 8080.
+            max_delay_ms (float): Maksymalny czas grupowania zapytań. Domyślnie 5.
+            max_batch (int): Maksymalna liczba zapytań w jednej porcji. Domyślnie 256.
+        """
+        self.recommender = recommender
+        self.host = host
+        self.port = port
+        self.batcher = MicroBatcher(recommender, max_delay_ms, max_batch)
+        self._server = None
+
+    async def start(self):
+        """Uruchamia serwer; po starcie atrybut port zawiera faktyczny port."""
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Zatrzymuje serwer i grupowanie zapytań."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        """Uruchamia serwer i obsługuje zapytania do przerwania."""
+        await self.start()
+        print(f"Serwer rekomendacji nasłuchuje na http://{self.host}:{self.port}")
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get('content-length', 0) or 0):
+                    await reader.readexactly(int(headers['content-length']))
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    status, body = 400, {'error': 'Niepoprawne zapytanie.'}
+                else:
+                    status, body = await self._route(parts[0], parts[1])
+                keep_alive = headers.get('connection', '').lower() != 'close' and parts[-1:] != ['HTTP/1.0']
+                payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(payload)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                    .encode('latin-1') + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, target):
+        if method != 'GET':
+            return 405, {'error': 'Obsługiwane są tylko zapytania GET.'}
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if url.path == '/health':
+            return 200, {'status': 'ok'}
+        if url.path == '/stats':
+            return 200, {'batching': self.batcher.stats(), 'cache': self.recommender.cache_info()}
+        if url.path != '/recommend':
+            return 404, {'error': 'Nieznany adres.'}
+        try:
+            user_id = int(query['user_id'][0])
+            top_n = max(1, int(query.get('top_n', ['5'])[0]))
+        except (KeyError, ValueError):
+            return 400, {'error': 'Podaj poprawne user_id i top_n.'}
+        genre = query.get('genre', [None])[0]
+        start = time.perf_counter()
+        try:
+            recommendations = await self.batcher.recommend(user_id, top_n, genre)
+        except ValueError as error:
+            return 404, {'error': str(error)}
+        except Exception as error:
+            return 500, {'error': str(error)}
+        return 200, {'user_id': user_id, 'recommendations': recommendations,
+                     'latency_ms': (time.perf_counter() - start) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokalny serwer rekomendacji filmów (HTTP/JSON).")
+    parser.add_argument('--model', default=None, help="Katalog modelu zapisanego przez save_model.")
+    parser.add_argument('--ratings', default='ratings.dat')
+    parser.add_argument('--movies', default='movies.dat')
+    parser.add_argument('--mode', choices=['user', 'item', 'als'], default='user')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-delay-ms', type=float, default=5)
+    parser.add_argument('--max-batch', type=int, default=256)
+    args = parser.parse_args()
+
+    if args.model:
+        recommender = MovieRecommender.load_model(args.model)
+    else:
+        recommender = MovieRecommender(args.ratings, args.movies, mode=args.mode)
+        print("Obliczanie podobieństwa...")
+        recommender.calculate_similarity(top_k=recommender.n_neighbors)
+
+    server = RecommendationServer(recommender, args.host, args.port, args.max_delay_ms, args.max_batch)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("Zamykanie serwera.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+from MovieReccomendationsSystem import MovieRecommender
+
+GENRES = ["Action", "Adventure", "Animation", "Children's", "Comedy", "Crime", "Documentary", "Drama", "Fantasy",
+          "Film-Noir", "Horror", "Musical", "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western"]
+
+
+def generate_dataset(directory, n_users=6040, n_movies=3700, density=0.045, alpha=1.0, seed=0):
+    """
+    Generuje syntetyczne pliki ratings.dat i movies.dat w formacie MovieLens ('::', ISO-8859-1).
+
+    Popularność filmów ma rozkład potęgowy (prawdopodobieństwo ~ 1 / ranga^alpha), a liczba ocen
+    użytkowników rozkład log-normalny, tak jak w prawdziwych zbiorach MovieLens.
+
+    Args:
+        directory (str): Katalog docelowy.
+        n_users (int): Liczba użytkowników. Domyślnie 6040 (MovieLens-1M).
+        n_movies (int): Liczba filmów. Domyślnie 3700.
+        density (float): Docelowy odsetek wypełnienia macierzy użytkownik-film. Domyślnie 0.045.
+        alpha (float): Wykładnik rozkładu popularności. Domyślnie 1.0.
+        seed (int): Ziarno generatora liczb losowych. Domyślnie 0.
+
+    Returns:
+        tuple: (ścieżka ratings.dat, ścieżka movies.dat, liczba wygenerowanych ocen).
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    ratings_path = os.path.join(directory, 'ratings.dat')
+    movies_path = os.path.join(directory, 'movies.dat')
+
+    with open(movies_path, 'w', encoding='ISO-8859-1') as file:
+        for movie_id in range(1, n_movies + 1):
+            genres = rng.choice(GENRES, size=rng.integers(1, 4), replace=False)
+            file.write(f"{movie_id}::Movie {movie_id} ({1920 + movie_id % 100})::{'|'.join(genres)}\n")
+
+    popularity = 1.0 / np.arange(1, n_movies + 1) ** alpha
+    popularity /= popularity.sum()
+    counts = rng.lognormal(mean=0.0, sigma=1.0, size=n_users)
+    counts = np.clip(np.round(counts / counts.mean() * density * n_movies), 1, n_movies).astype(np.int64)
+    users = np.repeat(np.arange(1, n_users + 1, dtype=np.int64), counts)
+    movies = rng.choice(np.arange(1, n_movies + 1, dtype=np.int64), size=len(users), p=popularity)
+    # losowanie ze zwracaniem - powtórzone pary użytkownik-film są usuwane
+    _, unique = np.unique(users * (n_movies + 1) + movies, return_index=True)
+    users, movies = users[unique], movies[unique]
+    ratings = rng.integers(1, 6, size=len(users))
+    timestamps = 956703932 + rng.integers(0, 10 ** 8, size=len(users))
+
+    with open(ratings_path, 'w', encoding='ISO-8859-1') as file:
+        file.writelines(f"{u}::{m}::{r}::{t}\n" for u, m, r, t in
+                        zip(users.tolist(), movies.tolist(), ratings.tolist(), timestamps.tolist()))
+    return ratings_path, movies_path, len(users)
+
+
+def measure(function, *args, **kwargs):
+    """
+    Wykonuje funkcję, mierząc czas i szczytowe zużycie pamięci (tracemalloc).
+
+    Returns:
+        tuple: (wynik funkcji, czas w sekundach, szczyt pamięci w MB).
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 2 ** 20
+
+
+def benchmark_recommender(ratings_path, movies_path, mode='user', method='exact', top_k=None,
+                          n_requests=200, top_n=10, seed=0):
+    """
+    Mierzy wczytywanie danych, budowę modelu, opóźnienia recommend_movies i get_all_genres.
+
+    Args:
+        ratings_path (str): Ścieżka do ratings.dat.
+        movies_path (str): Ścieżka do movies.dat.
+        mode (str): Tryb rekomendacji ('user', 'item', 'als'). Domyślnie 'user'.
+        method (str): Metoda podobieństwa w trybie 'user' ('exact', 'lsh'). Domyślnie 'exact'.
+        top_k (int): Liczba sąsiadów w indeksie (None - pełna macierz w trybie 'user'). Domyślnie None.
+        n_requests (int): Liczba mierzonych rekomendacji. Domyślnie 200.
+        top_n (int): Liczba rekomendacji na zapytanie. Domyślnie 10.
+        seed (int): Ziarno losowania użytkowników. Domyślnie 0.
+
+    Returns:
+        dict: Wyniki pomiarów (czasy w sekundach, opóźnienia w ms, pamięć w MB).
+    """
+    for cache in (ratings_path + '.cache.npz', movies_path + '.cache.npz'):
+        if os.path.exists(cache):
+            os.remove(cache)
+    recommender, load_cold, load_cold_mb = measure(
+        MovieRecommender, ratings_path, movies_path, mode=mode, cache_size=0
+    )
+    _, load_cached, _ = measure(MovieRecommender, ratings_path, movies_path, mode=mode, cache_size=0)
+    _, build, build_mb = measure(recommender.calculate_similarity, top_k=top_k, method=method)
+
+    rng = np.random.default_rng(seed)
+    user_ids = rng.choice(recommender.user_ids, size=min(n_requests, len(recommender.user_ids)), replace=False)
+    latencies = []
+    for user_id in user_ids.tolist():
+        start = time.perf_counter()
+        recommender.recommend_movies(user_id, top_n=top_n)
+        latencies.append((time.perf_counter() - start) * 1000)
+    _, genres_time, _ = measure(recommender.get_all_genres)
+
+    return {
+        'mode': mode,
+        'method': method,
+        'top_k': top_k,
+        'users': int(recommender.user_movie_matrix.shape[0]),
+        'movies': int(recommender.user_movie_matrix.shape[1]),
+        'ratings': int(recommender.user_movie_matrix.nnz),
+        'load_cold_s': load_cold,
+        'load_cached_s': load_cached,
+        'load_peak_mb': load_cold_mb,
+        'build_s': build,
+        'build_peak_mb': build_mb,
+        'recommend_p50_ms': float(np.percentile(latencies, 50)),
+        'recommend_p99_ms': float(np.percentile(latencies, 99)),
+        'get_all_genres_ms': genres_time * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MovieRecommender na syntetycznych danych MovieLens.")
+    parser.add_argument('--users', type=int, nargs='+', default=[6040],
+                        help="Liczby użytkowników (kilka wartości daje krzywą skalowania).")
+    parser.add_argument('--movies', type=int, default=3700)
+    parser.add_argument('--density', type=float, default=0.045)
+    parser.add_argument('--alpha', type=float, default=1.0, help="Wykładnik rozkładu popularności filmów.")
+    parser.add_argument('--mode', choices=['user', 'item', 'als'], default='user')
+    parser.add_argument('--method', choices=['exact', 'lsh'], default='exact')
+    parser.add_argument('--top-k', type=int, default=None)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=None, help="Katalog na wygenerowane dane (domyślnie tymczasowy).")
+    parser.add_argument('--output', default=None, help="Plik JSON z wynikami (domyślnie wypisanie na ekran).")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as temporary:
+        for n_users in args.users:
+            directory = os.path.join(args.data_dir or temporary, f"synthetic_{n_users}")
+            ratings_path, movies_path, _ = generate_dataset(
+                directory, n_users, args.movies, args.density, args.alpha, args.seed
+            )
+            result = benchmark_recommender(ratings_path, movies_path, args.mode, args.method, args.top_k,
+                                           args.requests, seed=args.seed)
+            print(f"{n_users} użytkowników: budowa {result['build_s']:.2f} s, "
+                  f"p50 {result['recommend_p50_ms']:.2f} ms, p99 {result['recommend_p99_ms']:.2f} ms")
+            results.append(result)
+
+    report = {
+        'config': vars(args),
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
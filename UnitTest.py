@@ -1,7 +1,22 @@
+import json
+import multiprocessing
+import os
+import tempfile
 import unittest
+from unittest import mock
 import pandas as pd
 import numpy as np
-from MovieReccomendationsSystem import MovieRecommender
+from scipy import sparse
+from sklearn.metrics.pairwise import cosine_similarity
+from MovieReccomendationsSystem import MovieRecommender, _als_step, _update_neighbor_lists, load_dat
+from RecommenderBenchmark import generate_dataset
+from RecommendationServer import RecommendationServer
+from RecommendationLoadTest import run_load
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from PriceMonitoring import (FetchDeadlineExceeded, LogHistogram, PriceFetcher, PriceHistory, PriceMonitor, Product,
+                             ProductCatalogue, extract_price_text, parse_price)
 class TestMovieRecommender(unittest.TestCase):
     def setUp(self):
         self.recommender = MovieRecommender()
@@ -16,12 +31,31 @@ class TestMovieRecommender(unittest.TestCase):
     def test_recommend_movies(self):
         recommendations = self.recommender.recommend_movies(1, top_n=3)
         self.assertEqual(len(recommendations), 3)
-        self.assertTrue(all(isinstance(movie, str) for movie in recommendations))
+        self.assertTrue(all(isinstance(movie, tuple) and len(movie) == 3 for movie in recommendations))
+        self.assertTrue(all(isinstance(title, str) for title, genres, score in recommendations))
+
+    def test_recommendations_ranked_and_unseen(self):
+        """Test that recommendations are ranked by score and skip movies the user has seen."""
+        recommendations = self.recommender.recommend_movies(1, top_n=10)
+        scores = [score for title, genres, score in recommendations]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        seen_ids = self.recommender.ratings.loc[self.recommender.ratings['userId'] == 1, 'movieId']
+        seen_titles = set(self.recommender.movies.loc[self.recommender.movies['movieId'].isin(seen_ids), 'title'])
+        self.assertTrue(seen_titles.isdisjoint(title for title, genres, score in recommendations))
+
+    def test_sort_by_reorders_top_scored(self):
+        """Test that sort_by only reorders the top_n best-scored movies instead of choosing other ones."""
+        by_score = self.recommender.recommend_movies(1, top_n=10)
+        for sort_by, column in (('title', 0), ('genre', 1)):
+            reordered = self.recommender.recommend_movies(1, top_n=10, sort_by=sort_by)
+            self.assertEqual(sorted(reordered), sorted(by_score))
+            self.assertEqual(reordered, sorted(by_score, key=lambda movie: movie[column]))
 
     def test_no_ratings_for_user(self):
         """Test the case where a user has no ratings."""
         # Create a mock user with no ratings
-        self.recommender.user_movie_matrix.iloc[0, :] = 0  # First user with no ratings
+        matrix = self.recommender.user_movie_matrix
+        matrix.data[matrix.indptr[0]:matrix.indptr[1]] = 0  # First user with no ratings
         recommendations = self.recommender.recommend_movies(1, top_n=3)
         self.assertEqual(recommendations, [])
 
@@ -44,18 +78,737 @@ class TestMovieRecommender(unittest.TestCase):
 
         # Manually calculate similarity for testing
         recommender = MovieRecommender()
-        recommender.user_movie_matrix = pd.DataFrame(small_matrix)
+        recommender.user_movie_matrix = sparse.csr_matrix(small_matrix)
         recommender.calculate_similarity()
 
         # Cosine similarity between the first and second user (should be positive)
         similarity = recommender.similarity_matrix[0, 1]
         self.assertGreater(similarity, 0)
 
+    def test_sparse_matrix_layout(self):
+        """Test that ratings are held as a compact CSR matrix with id mappings."""
+        matrix = self.recommender.user_movie_matrix
+        self.assertTrue(sparse.isspmatrix_csr(matrix))
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertEqual(matrix.nnz, len(self.recommender.ratings))
+        row = self.recommender.ratings.iloc[0]
+        user_row = self.recommender.user_index[row['userId']]
+        movie_col = self.recommender.movie_index[row['movieId']]
+        self.assertEqual(self.recommender.user_ids[user_row], row['userId'])
+        self.assertEqual(matrix[user_row, movie_col], row['rating'])
+
+    def test_top_k_neighbor_index(self):
+        """Test that the blocked top-k index matches the full similarity matrix."""
+        recommender = MovieRecommender()
+        neighbor_ids, neighbor_weights = recommender.calculate_similarity(top_k=10, max_block_mb=0.05)
+        self.assertIsNone(recommender.similarity_matrix)
+        self.assertEqual(neighbor_ids.shape, (recommender.user_movie_matrix.shape[0], 10))
+        self.assertEqual(neighbor_ids.dtype, np.int32)
+        self.assertEqual(neighbor_weights.dtype, np.float32)
+
+        full = self.recommender.similarity_matrix.copy()
+        np.fill_diagonal(full, -np.inf)
+        expected = -np.sort(-full, axis=1)[:, :10]
+        np.testing.assert_allclose(neighbor_weights, expected, atol=1e-5)
+
+    def test_top_k_must_be_positive(self):
+        """Test that an empty neighbour index is rejected instead of failing later in recommend_movies."""
+        for mode in ('user', 'item'):
+            recommender = MovieRecommender(mode=mode)
+            for method in ('exact', 'lsh'):
+                with self.assertRaises(ValueError):
+                    recommender.calculate_similarity(top_k=0, method=method)
+        with self.assertRaises(ValueError):
+            recommender.calculate_item_similarity(top_k=-1)
+
+    def test_recommend_with_neighbor_index(self):
+        """Test that recommendations from the top-k index match the full matrix."""
+        recommender = MovieRecommender()
+        recommender.calculate_similarity(top_k=recommender.n_neighbors)
+        expected = self.recommender.recommend_movies(1, top_n=5)
+        recommendations = recommender.recommend_movies(1, top_n=5)
+        self.assertEqual([score for _, _, score in recommendations], [score for _, _, score in expected])
+
+    def test_recommend_batch_matches_single(self):
+        """Test that batch recommendations agree with recommend_movies."""
+        user_ids = self.recommender.user_ids[:20]
+        batch = self.recommender.recommend_batch(user_ids, top_n=5, chunk_size=7)
+        self.assertEqual(list(batch.columns), ['userId', 'rank', 'movieId', 'score'])
+        for user_id in user_ids[:3]:
+            expected = [score for _, _, score in self.recommender.recommend_movies(user_id, top_n=5)]
+            scores = batch.loc[batch['userId'] == user_id].sort_values('rank')['score'].tolist()
+            np.testing.assert_allclose(scores, expected)
+
+    def test_recommend_batch_process_pool(self):
+        """Test that fanning chunks out to processes gives the same result."""
+        user_ids = self.recommender.user_ids[:30]
+        serial = self.recommender.recommend_batch(user_ids, top_n=3, chunk_size=10)
+        parallel = self.recommender.recommend_batch(user_ids, top_n=3, chunk_size=10, n_jobs=2)
+        pd.testing.assert_frame_equal(serial, parallel)
+
+    def test_recommend_batch_spawn_pool(self):
+        """Test that the model is picklable for platforms without fork (spawn start method)."""
+        user_ids = self.recommender.user_ids[:20]
+        self.recommender.recommend_movies(user_ids[0], top_n=3)
+        serial = self.recommender.recommend_batch(user_ids, top_n=3, chunk_size=10)
+        with mock.patch('MovieReccomendationsSystem.pool_context', return_value=multiprocessing.get_context('spawn')):
+            parallel = self.recommender.recommend_batch(user_ids, top_n=3, chunk_size=10, n_jobs=2)
+        pd.testing.assert_frame_equal(serial, parallel)
+        self.assertEqual(self.recommender.cache_info()['size'], 1)
+
+    def test_save_and_load_model(self):
+        """Test that a saved model answers requests after a memory-mapped load."""
+        recommender = MovieRecommender()
+        recommender.calculate_similarity(top_k=recommender.n_neighbors)
+        with tempfile.TemporaryDirectory() as directory:
+            recommender.save_model(directory)
+            loaded = MovieRecommender.load_model(directory, mmap=True)
+            self.assertIsInstance(loaded.neighbor_ids, np.memmap)
+            self.assertIsNone(loaded.similarity_matrix)
+            self.assertEqual(loaded.user_movie_matrix.shape, recommender.user_movie_matrix.shape)
+            self.assertEqual(loaded.recommend_movies(1, top_n=5), recommender.recommend_movies(1, top_n=5))
+            del loaded
+
+    def test_resave_model_keeps_mapped_arrays(self):
+        """Test that saving over a model does not change arrays mapped by an earlier load."""
+        recommender = MovieRecommender()
+        recommender.calculate_similarity(top_k=20)
+        with tempfile.TemporaryDirectory() as directory:
+            recommender.save_model(directory)
+            loaded = MovieRecommender.load_model(directory, mmap=True)
+            expected = loaded.recommend_movies(1, top_n=5)
+            neighbor_ids = np.array(loaded.neighbor_ids)
+            for top_k in (5, 10):
+                recommender.calculate_similarity(top_k=top_k)
+                recommender.save_model(directory)
+            np.testing.assert_array_equal(loaded.neighbor_ids, neighbor_ids)
+            loaded.result_cache.clear()
+            self.assertEqual(loaded.recommend_movies(1, top_n=5), expected)
+            self.assertEqual(MovieRecommender.load_model(directory).neighbor_ids.shape[1], 10)
+            self.assertEqual(len([entry for entry in os.listdir(directory) if entry.startswith('arrays-')]), 2)
+            del loaded
+
+    def test_lsh_neighbor_index(self):
+        """Test that approximate neighbours carry exact similarities and report their recall."""
+        recommender = MovieRecommender()
+        neighbor_ids, neighbor_weights = recommender.calculate_similarity(top_k=10, method='lsh')
+        self.assertEqual(neighbor_ids.shape, (recommender.user_movie_matrix.shape[0], 10))
+        found = np.isfinite(neighbor_weights)
+        rows = np.nonzero(found)[0]
+        np.testing.assert_allclose(
+            neighbor_weights[found], self.recommender.similarity_matrix[rows, neighbor_ids[found]], atol=1e-5
+        )
+
+        # uncentred hashing reached 0.92 with the defaults and 0.76 with 4 tables on this data
+        report = recommender.neighbor_recall(sample_size=200)
+        self.assertEqual(report['sample_size'], 200)
+        self.assertGreaterEqual(report['recall'], 0.97)
+        self.assertLessEqual(report['recall'], 1)
+        self.assertTrue(recommender.recommend_movies(1, top_n=3))
+
+        recommender.calculate_similarity(top_k=10, method='lsh', n_tables=4)
+        self.assertGreaterEqual(recommender.neighbor_recall(sample_size=200)['recall'], 0.9)
+
+    def test_add_ratings_updates_similarity(self):
+        """Test that incremental updates match a full similarity rebuild."""
+        new_user = int(self.recommender.user_ids.max()) + 1
+        new_ratings = pd.DataFrame({
+            'userId': [1, 1, new_user, new_user],
+            'movieId': self.recommender.movie_ids[[0, 1, 0, 2]],
+            'rating': [5.0, 1.0, 4.0, 3.0],
+        })
+        self.recommender.add_ratings(new_ratings)
+        matrix = self.recommender.user_movie_matrix
+        self.assertEqual(matrix.shape[0], len(self.recommender.user_ids))
+        self.assertEqual(matrix[self.recommender.user_index[new_user], 2], 3.0)
+        np.testing.assert_allclose(self.recommender.similarity_matrix, cosine_similarity(matrix), atol=1e-5)
+        self.assertTrue(self.recommender.recommend_movies(new_user, top_n=3))
+
+    def test_add_ratings_defers_ratings_frame(self):
+        """Test that new ratings are merged into the ratings frame only when it is read."""
+        seen_movie = int(self.recommender.ratings.loc[self.recommender.ratings['userId'] == 1, 'movieId'].iloc[0])
+        new_user = int(self.recommender.user_ids.max()) + 1
+        self.recommender.add_ratings(pd.DataFrame({'userId': [1], 'movieId': [seen_movie], 'rating': [2.0]}))
+        self.recommender.add_ratings(pd.DataFrame({'userId': [new_user], 'movieId': [seen_movie], 'rating': [4.0]}))
+        self.assertEqual(len(self.recommender._pending_ratings), 2)
+        ratings = self.recommender.ratings
+        self.assertEqual(self.recommender._pending_ratings, [])
+        self.assertEqual(len(ratings), self.recommender.user_movie_matrix.nnz)
+        pair = ratings.loc[(ratings['userId'] == 1) & (ratings['movieId'] == seen_movie), 'rating']
+        self.assertEqual(pair.tolist(), [2.0])
+
+    def test_update_neighbor_lists_several_changed_rows(self):
+        """Test that each changed row replaces the weakest neighbour, not the last slot."""
+        neighbor_ids = np.array([[1, 2, 3]] + [[0, 1, 2]] * 5, dtype=np.int32)
+        neighbor_weights = np.array([[0.9, 0.2, 0.1]] + [[0.9, 0.8, 0.7]] * 5, dtype=np.float32)
+        similarities = np.zeros((2, 6), dtype=np.float32)
+        similarities[:, 0] = [0.5, 0.3]
+        _update_neighbor_lists(neighbor_ids, neighbor_weights, np.array([4, 5]), similarities)
+        self.assertEqual(neighbor_ids[0].tolist(), [1, 4, 5])
+        np.testing.assert_allclose(neighbor_weights[0], [0.9, 0.5, 0.3])
+        self.assertEqual(neighbor_ids[1].tolist(), [0, 1, 2])
+
+    def test_add_ratings_updates_neighbor_index(self):
+        """Test that the top-k lists of users with new ratings are exact after an update."""
+        recommender = MovieRecommender()
+        recommender.calculate_similarity(top_k=10)
+        new_ratings = pd.DataFrame({'userId': [2, 3], 'movieId': recommender.movie_ids[[5, 6]], 'rating': [4.0, 2.0]})
+        recommender.add_ratings(new_ratings)
+        neighbor_weights = recommender.neighbor_weights.copy()
+        _, expected = recommender.calculate_similarity(top_k=10)
+        for user_id in (2, 3):
+            row = recommender.user_index[user_id]
+            np.testing.assert_allclose(neighbor_weights[row], expected[row], atol=1e-5)
+
+    def test_genre_filter_before_ranking(self):
+        """Test that genre filtering happens before top-N selection."""
+        genre = self.recommender.get_all_genres()[0]
+        recommendations = self.recommender.recommend_movies(1, top_n=5, genre=genre)
+        self.assertEqual(len(recommendations), 5)
+        self.assertTrue(all(genre.lower() in genres for _, genres, _ in recommendations))
+
+        unfiltered = self.recommender.recommend_movies(1, top_n=10 ** 6)
+        expected = [movie for movie in unfiltered if genre.lower() in movie[1]][:5]
+        self.assertEqual([score for _, _, score in recommendations], [score for _, _, score in expected])
+
+    def test_get_all_genres(self):
+        """Test that the genre index lists every genre from the movies file."""
+        expected = sorted({genre for genres in self.recommender.movies['genres'] for genre in genres.split('|')})
+        self.assertEqual(self.recommender.get_all_genres(), expected)
+
+    def test_movie_metadata_index(self):
+        """Test that matrix columns map to the right movie rows, also after movies change."""
+        movies = self.recommender.movies
+        columns = np.flatnonzero(self.recommender.movie_rows >= 0)
+        np.testing.assert_array_equal(
+            movies['movieId'].to_numpy()[self.recommender.movie_rows[columns]],
+            self.recommender.movie_ids[columns]
+        )
+
+        top_title = self.recommender.recommend_movies(1, top_n=1)[0][0]
+        self.recommender.movies = movies[movies['title'] != top_title].reset_index(drop=True)
+        recommendations = self.recommender.recommend_movies(1, top_n=3)
+        self.assertEqual(len(recommendations), 3)
+        self.assertNotIn(top_title, [title for title, _, _ in recommendations])
+
+    def test_item_mode_scores(self):
+        """Test item-item scoring against a direct computation on the item similarity matrix."""
+        recommender = MovieRecommender(mode='item')
+        neighbor_ids, neighbor_weights = recommender.calculate_similarity(top_k=20)
+        self.assertEqual(neighbor_ids.shape, (recommender.user_movie_matrix.shape[1], 20))
+
+        matrix = recommender.user_movie_matrix
+        item_similarity = cosine_similarity(matrix.T)
+        np.fill_diagonal(item_similarity, 0)
+        weights = np.zeros_like(item_similarity)
+        rows = np.arange(len(neighbor_ids))[:, None]
+        weights[rows, neighbor_ids] = item_similarity[rows, neighbor_ids]
+        scores = matrix[0].toarray().ravel() @ weights
+        scores[matrix[0].indices] = 0
+
+        recommendations = recommender.recommend_movies(1, top_n=5)
+        np.testing.assert_allclose([score for _, _, score in recommendations], -np.sort(-scores)[:5], rtol=1e-4)
+
+    def test_item_mode_add_ratings(self):
+        """Test that item neighbour lists of rated movies are exact after an update."""
+        recommender = MovieRecommender(mode='item')
+        recommender.calculate_similarity(top_k=10)
+        movie_ids = recommender.movie_ids[[3, 4]]
+        recommender.add_ratings(pd.DataFrame({'userId': [1, 2], 'movieId': movie_ids, 'rating': [5.0, 3.0]}))
+        neighbor_weights = recommender.item_neighbor_weights.copy()
+        _, expected = recommender.calculate_similarity(top_k=10)
+        np.testing.assert_allclose(neighbor_weights[[3, 4]], expected[[3, 4]], atol=1e-5)
+        self.assertTrue(recommender.recommend_movies(1, top_n=3))
+
+    def test_als_mode(self):
+        """Test that ALS learns compact factors that fit the ratings and score by dot product."""
+        recommender = MovieRecommender(mode='als')
+        user_factors, movie_factors = recommender.fit_als(factors=16, iterations=5)
+        self.assertEqual(user_factors.shape, (recommender.user_movie_matrix.shape[0], 16))
+        self.assertEqual(movie_factors.dtype, np.float32)
+
+        ratings = recommender.user_movie_matrix.tocoo()
+        predictions = (user_factors[ratings.row] * movie_factors[ratings.col]).sum(axis=1)
+        rmse = np.sqrt(np.mean((predictions - ratings.data) ** 2))
+        self.assertLess(rmse, ratings.data.std())
+
+        best = recommender.recommend_batch([1], top_n=1).iloc[0]
+        row, col = recommender.user_index[1], recommender.movie_index[best['movieId']]
+        self.assertAlmostEqual(best['score'], float(user_factors[row] @ movie_factors[col]), places=4)
+
+    def test_als_add_ratings_folds_in_user(self):
+        """Test that a new user gets ALS factors without retraining."""
+        recommender = MovieRecommender(mode='als')
+        recommender.fit_als(factors=8, iterations=3)
+        new_user = int(recommender.user_ids.max()) + 1
+        recommender.add_ratings(pd.DataFrame({
+            'userId': [new_user] * 3, 'movieId': recommender.movie_ids[:3], 'rating': [5.0, 4.0, 5.0]
+        }))
+        self.assertEqual(len(recommender.user_factors), len(recommender.user_ids))
+        self.assertEqual(len(recommender.recommend_movies(new_user, top_n=3)), 3)
+
+    def test_als_step_blocked_columns(self):
+        """Test that an ALS step split into row and column blocks matches the unblocked one."""
+        matrix = self.recommender.user_movie_matrix.astype(np.float32)
+        fixed = np.random.default_rng(0).standard_normal((matrix.shape[1], 8)).astype(np.float32)
+        expected = _als_step(matrix, fixed, 0.1)
+        blocked = _als_step(matrix, fixed, 0.1, max_block_mb=0.05)
+        np.testing.assert_allclose(blocked, expected, rtol=1e-3, atol=1e-4)
+
+    def test_result_cache(self):
+        """Test that repeated queries reuse the cached ranking with any top_n/sort_by."""
+        top = self.recommender.recommend_movies(1, top_n=10)
+        self.assertEqual(self.recommender.cache_info()['misses'], 1)
+        by_title = self.recommender.recommend_movies(1, top_n=5, sort_by='title')
+        self.assertEqual(self.recommender.recommend_movies(1, top_n=3), top[:3])
+        info = self.recommender.cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (2, 1, 1))
+        self.assertEqual(by_title, sorted(top[:5], key=lambda movie: movie[0]))
+
+        self.recommender.recommend_movies(1, top_n=3, genre='drama')
+        self.assertEqual(self.recommender.cache_info()['misses'], 2)
+
+    def test_result_cache_invalidation(self):
+        """Test that new ratings or a recomputed model invalidate cached rankings."""
+        recommendations = self.recommender.recommend_movies(1, top_n=3)
+        seen_movie = self.recommender.movies.loc[
+            self.recommender.movies['title'] == recommendations[0][0], 'movieId'].iloc[0]
+        self.recommender.add_ratings(pd.DataFrame({'userId': [1], 'movieId': [seen_movie], 'rating': [3.0]}))
+        self.assertEqual(self.recommender.cache_info()['size'], 0)
+        self.assertNotIn(recommendations[0][0], [title for title, _, _ in self.recommender.recommend_movies(1, top_n=3)])
+
+        self.recommender.calculate_similarity(top_k=10)
+        self.assertEqual(self.recommender.cache_info()['size'], 0)
+
     def test_empty_movie_list(self):
         """Test case where the movie list is empty."""
         self.recommender.movies = pd.DataFrame(columns=['movieId', 'title'])
         recommendations = self.recommender.recommend_movies(1, top_n=3)
         self.assertEqual(recommendations, [])
 
+    def test_save_model_without_genres(self):
+        """Test that a movie list without a genres column can be saved and loaded."""
+        self.recommender.movies = self.recommender.movies[['movieId', 'title']]
+        with tempfile.TemporaryDirectory() as directory:
+            self.recommender.save_model(directory)
+            loaded = MovieRecommender.load_model(directory, mmap=False)
+        self.assertEqual(set(loaded.movies['genres']), {''})
+        self.assertEqual(loaded.recommend_movies(1, top_n=3), self.recommender.recommend_movies(1, top_n=3))
+
+class TestLoadDat(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'movies.dat')
+        with open(self.path, 'w', encoding='ISO-8859-1') as file:
+            file.write('1::Toy Story (1995)::Animation|Children\'s|Comedy\n')
+            file.write('2::"Great Day in Harlem, A" (1994)::Documentary\n')
+        self.names = ['movieId', 'title', 'genres']
+        self.dtypes = {'movieId': np.int32, 'title': str, 'genres': str}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_parse_and_cache(self):
+        """Test that the .dat file is parsed once and then served from the cache."""
+        movies = load_dat(self.path, self.names, self.dtypes)
+        self.assertEqual(movies['title'].tolist(), ['Toy Story (1995)', '"Great Day in Harlem, A" (1994)'])
+        self.assertEqual(movies['movieId'].dtype, np.int32)
+        self.assertTrue(os.path.exists(self.path + '.cache.npz'))
+
+        cached = load_dat(self.path, self.names, self.dtypes)
+        self.assertEqual(cached['title'].tolist(), movies['title'].tolist())
+        self.assertEqual(cached['genres'].tolist(), movies['genres'].tolist())
+
+    def test_cache_invalidated_on_change(self):
+        """Test that a modified source file is parsed again."""
+        load_dat(self.path, self.names, self.dtypes)
+        with open(self.path, 'a', encoding='ISO-8859-1') as file:
+            file.write('3::Heat (1995)::Action|Crime|Thriller\n')
+        movies = load_dat(self.path, self.names, self.dtypes)
+        self.assertEqual(movies['movieId'].tolist(), [1, 2, 3])
+
+
+class TestSyntheticDataset(unittest.TestCase):
+    def test_generated_files_load(self):
+        """Test that the benchmark generator writes MovieLens-format files with skewed popularity."""
+        with tempfile.TemporaryDirectory() as directory:
+            ratings_path, movies_path, n_ratings = generate_dataset(directory, n_users=200, n_movies=300, density=0.05)
+            recommender = MovieRecommender(ratings_path, movies_path, use_cache=False)
+        self.assertEqual(recommender.user_movie_matrix.nnz, n_ratings)
+        self.assertEqual(len(recommender.movies), 300)
+        popularity = np.diff(recommender.user_movie_matrix.tocsc().indptr)
+        self.assertGreater(popularity[:10].mean(), popularity[-100:].mean())
+
+
+class TestRecommendationServer(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_requests_are_batched(self):
+        """Test that concurrent HTTP requests are coalesced and match recommend_movies."""
+        with tempfile.TemporaryDirectory() as directory:
+            ratings_path, movies_path, _ = generate_dataset(directory, n_users=200, n_movies=300, density=0.05)
+            recommender = MovieRecommender(ratings_path, movies_path, use_cache=False)
+        recommender.calculate_similarity()
+        server = RecommendationServer(recommender, port=0, max_delay_ms=50)
+        await server.start()
+        try:
+            user_ids = list(range(1, 41))
+            result = await run_load('127.0.0.1', server.port, user_ids, concurrency=40, top_n=3)
+            self.assertEqual(result['requests'], 40)
+            self.assertEqual(result['errors'], 0)
+            self.assertLess(server.batcher.batches, 40)
+            recommendations = await server.batcher.recommend(7, top_n=3)
+            self.assertEqual([movie['title'] for movie in recommendations],
+                             [title for title, genres, score in recommender.recommend_movies(7, top_n=3)])
+            with self.assertRaises(ValueError):
+                await server.batcher.recommend(10 ** 6)
+        finally:
+            await server.stop()
+
+
+class FakeResponse:
+    def __init__(self, text, status_code=200, headers=None):
+        self.text = text
+        self.content = text.encode('utf-8')
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeSession:
+    """Serves product pages from a dict, recording requests and peak concurrency."""
+    def __init__(self, pages, delay=0.0, etags=None):
+        self.pages = pages
+        self.delay = delay
+        self.etags = etags or {}
+        self.requests = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, timeout=None, headers=None):
+        with self.lock:
+            self.requests.append((url, headers))
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        etag = self.etags.get(url)
+        if etag and (headers or {}).get('If-None-Match') == etag:
+            return FakeResponse('', status_code=304)
+        return FakeResponse(self.pages[url], headers={'ETag': etag} if etag else {})
+
+    def close(self):
+        pass
+
+
+def product_page(price):
+    return f'<html><body><article class="product_page"><p class="price_color">{price}</p></article></body></html>'
+
+
+class TestPriceMonitor(unittest.TestCase):
+    def setUp(self):
+        self.pages = {f"http://shop.test/book_{i}/index.html": product_page(f"£{10 + i}.50") for i in range(8)}
+        self.session = FakeSession(self.pages, delay=0.05)
+        self.monitor = PriceMonitor(products=[Product(f"Book {i}", url) for i, url in enumerate(self.pages)])
+        self.monitor.fetcher = PriceFetcher(max_workers=8, session=self.session, rate=1000, burst=1000)
+
+    def test_update_all_prices_concurrently(self):
+        """Test that prices are fetched in parallel over the shared session."""
+        self.monitor.update_all_prices()
+        self.assertEqual([product.current_price for product in self.monitor.products],
+                         [(10 + i + 0.5) * 5 for i in range(8)])
+        self.assertEqual(len(self.session.requests), 8)
+        self.assertGreater(self.session.peak, 1)
+
+    def test_conditional_requests_skip_parsing(self):
+        """Test that 304 responses and identical bodies are not parsed again."""
+        urls = list(self.pages)
+        self.session.etags = {url: f'"v{i}"' for i, url in enumerate(urls[:4])}
+        self.monitor.update_all_prices()
+        self.pages[urls[5]] = product_page("£99.00")
+        self.monitor.update_all_prices()
+        stats = self.monitor.fetcher.stats
+        self.assertEqual(stats['not_modified'], 4)
+        self.assertEqual(stats['unchanged'], 3)
+        self.assertEqual(stats['parses_skipped'], 7)
+        self.assertEqual(stats['bytes_saved'], sum(len(self.pages[url].encode("utf-8")) for url in urls[:4]))
+        self.assertEqual(sum(1 for url, headers in self.session.requests if headers), 4)
+        self.assertEqual(self.monitor.products[5].current_price, 99.0 * 5)
+
+    def test_price_extractors(self):
+        """Test the fast extraction paths and the fallback to a full parse."""
+        url = "http://books.toscrape.com/catalogue/a-light-in-the-attic_1000/index.html"
+        self.assertEqual(extract_price_text(url, product_page("£51.77")), "£51.77")
+        self.assertEqual(extract_price_text("http://shop.test/x", product_page("&pound;51.77")), "£51.77")
+        # Unquoted attribute misses both regexes and the strained parse still finds the element
+        page = '<div><p id="p" class=price_color>\n 12,50 EUR </p></div>'
+        self.assertEqual(extract_price_text(url, page), "12,50 EUR")
+        self.assertIsNone(extract_price_text(url, "<p>brak ceny</p>"))
+        self.assertAlmostEqual(parse_price("12,50 EUR"), 12.5 * 4.4)
+        self.assertEqual(parse_price("30.00 PLN"), 30.0)
+
+    def test_retry_after_and_host_rate_limit(self):
+        """Test that 429 responses are retried after Retry-After and each host is rate limited."""
+        url = list(self.pages)[0]
+        responses = [FakeResponse('', 429, {'Retry-After': '0.1'}), FakeResponse(self.pages[url])]
+        self.session.get = lambda url, timeout=None, headers=None: responses.pop(0)
+        fetcher = PriceFetcher(session=self.session, rate=10, burst=1)
+        start = time.perf_counter()
+        self.assertEqual(fetcher.get(url).status_code, 200)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.1)
+        self.assertEqual(fetcher.stats['retries'], 1)
+
+        self.session.get = lambda url, timeout=None, headers=None: FakeResponse(self.pages[url])
+        start = time.perf_counter()
+        for _ in range(4):
+            fetcher.get(url)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.3)
+
+    def test_long_retry_after_pauses_host(self):
+        """Test that a Retry-After beyond max_backoff is not retried early and holds back the whole host."""
+        url, other = list(self.pages)[:2]
+        self.session.get = lambda url, timeout=None, headers=None: FakeResponse('', 429, {'Retry-After': '60'})
+        fetcher = PriceFetcher(session=self.session, rate=1000, burst=10, max_backoff=30)
+        start = time.perf_counter()
+        self.assertEqual(fetcher.get(url).status_code, 429)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(fetcher.stats['retries'], 0)
+
+        requested = []
+        self.session.get = lambda url, timeout=None, headers=None: requested.append(url) or FakeResponse(self.pages[url])
+        with self.assertRaises(FetchDeadlineExceeded):
+            fetcher.get(other, deadline=time.monotonic() + 0.2)
+        self.assertEqual(requested, [])
+
+    def test_cycle_deadline(self):
+        """Test that a slow host cannot stall the update cycle past its budget."""
+        self.session.delay = 0.3
+        self.monitor.fetcher = PriceFetcher(max_workers=2, session=self.session, rate=1000, burst=1000, per_host=1)
+        start = time.perf_counter()
+        self.monitor.update_all_prices(budget=0.5)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertLess(len(self.session.requests), 8)
+        self.assertGreater(self.monitor.fetcher.stats['deadline_exceeded'], 0)
+
+    def test_bulk_harvest_from_listing_pages(self):
+        """Test that products are updated from listing pages with a per-product fallback."""
+        root = "http://books.toscrape.com/catalogue/"
+        def listing(ids):
+            return ''.join(f'<article class="product_pod"><h3><a href="book-{i}_{i}/index.html" title="B">B</a></h3>'
+                           f'<div class="product_price"><p class="price_color">£{i}.00</p></div></article>'
+                           for i in ids)
+
+        pages = {root + "page-1.html": listing(range(981, 1001)), root + "book-980_980/index.html": product_page("£3.00"),
+                 root + "book-990_990/index.html": product_page("£7.00")}
+        self.session.pages = pages
+        self.monitor.products = [Product(f"Book {i}", root + f"book-{i}_{i}/index.html") for i in (1000, 990, 985)]
+        self.monitor.products.append(Product("Moved", root + "book-980_980/index.html"))
+        # Book 980 has moved off page-2 (where its id places it), so it is fetched from its own page
+        pages[root + "page-2.html"] = listing(range(961, 980))
+        self.monitor.update_all_prices(bulk=True)
+        self.assertEqual([product.current_price for product in self.monitor.products], [5000.0, 4950.0, 4925.0, 15.0])
+        self.assertEqual(len(self.session.requests), 3)
+        self.assertEqual(self.monitor.listing_pages[root + "book-981_981/index.html"], root + "page-1.html")
+        self.assertIsNone(self.monitor.listing_pages[root + "book-980_980/index.html"])
+
+    def test_fetch_parse_pipeline(self):
+        """Test that pages fetched by threads are parsed in a process pool through a bounded queue."""
+        self.monitor.parse_processes, self.monitor.queue_size = 2, 2
+        try:
+            self.monitor.update_all_prices()
+            self.assertEqual([product.current_price for product in self.monitor.products],
+                             [(10 + i + 0.5) * 5 for i in range(8)])
+            self.pages[list(self.pages)[3]] = product_page("20,00 PLN")
+            self.monitor.update_all_prices()
+            self.assertEqual(self.monitor.products[3].current_price, 20.0)
+            self.assertEqual(self.monitor.fetcher.stats['parses_skipped'], 7)
+        finally:
+            self.monitor.close()
+
+    def test_pipeline_recovers_from_broken_pool(self):
+        """Test that a broken parse pool neither hangs the cycle nor marks unparsed pages as seen."""
+        class BrokenPool:
+            def submit(self, *args):
+                raise BrokenProcessPool("worker killed")
+
+            def shutdown(self, **kwargs):
+                pass
+
+        self.monitor.parse_processes, self.monitor.queue_size = 2, 1
+        self.monitor._parse_executor = BrokenPool()
+        try:
+            cycle = threading.Thread(target=self.monitor.update_all_prices, daemon=True)
+            cycle.start()
+            cycle.join(10)
+            self.assertFalse(cycle.is_alive())
+            self.assertIsNone(self.monitor._parse_executor)
+            self.assertTrue(all(product.content_hash is None for product in self.monitor.products))
+            self.monitor.update_all_prices()
+            self.assertEqual([product.current_price for product in self.monitor.products],
+                             [(10 + i + 0.5) * 5 for i in range(8)])
+        finally:
+            self.monitor.close()
+
+    def test_catalogue_indexes_follow_price_updates(self):
+        """Test name search, duplicate detection and the price index kept in sync with price changes."""
+        catalogue = ProductCatalogue(Product(f"Book {i}", current_price=float(20 - i)) for i in range(20))
+        self.assertEqual([product.name for product in catalogue.search("OOK 1")],
+                         ["Book 1"] + [f"Book {i}" for i in range(10, 20)])
+        self.assertEqual([product.name for product in catalogue.search("k 7")], ["Book 7"])
+        with self.assertRaises(ValueError):
+            catalogue.append(Product("book 3"))
+        self.assertEqual([product.name for product in catalogue.cheapest(2)], ["Book 19", "Book 18"])
+        catalogue.get("Book 5").current_price = 0.5
+        catalogue.get("Book 19").current_price = 30.0
+        self.assertEqual([product.name for product in catalogue.cheapest(2)], ["Book 5", "Book 18"])
+        self.assertEqual(sorted(product.current_price for product in catalogue.price_range(3.0, 5.0)), [3.0, 4.0, 5.0])
+        catalogue.remove(catalogue.get("Book 5"))
+        self.assertEqual(catalogue.cheapest(1)[0].name, "Book 18")
+        self.assertEqual(catalogue.search("book 5"), [])
+        self.assertEqual(len(catalogue), 19)
+
+    def test_monitor_uses_catalogue(self):
+        """Test that PriceMonitor rejects duplicate names and answers cheapest-product queries from the index."""
+        self.monitor.update_all_prices()
+        self.assertIs(self.monitor.get_cheapest_product(), self.monitor.products[0])
+        self.monitor.add_product("book 0", "http://shop.test/other")
+        self.assertEqual(len(self.monitor.products), 8)
+        self.assertEqual(len(PriceMonitor().products), 0)
+
+    def test_fetch_metrics(self):
+        """Test that fetch stages, response sizes and errors are recorded per host and history writes separately."""
+        self.monitor.update_all_prices()
+        self.monitor.products[0].url = "http://down.test/page"
+        self.session.get = lambda url, timeout=None, headers=None: FakeResponse('', 500)
+        self.monitor.fetcher.retries = 0
+        self.monitor.products[0].update_price(self.monitor.fetcher)
+        with tempfile.TemporaryDirectory() as directory:
+            self.monitor.append_prices_to_history(os.path.join(directory, 'ceny.db'))
+            self.monitor.metrics.dump_json(os.path.join(directory, 'metrics.json'))
+            with open(os.path.join(directory, 'metrics.json'), encoding='utf-8') as file:
+                report = json.load(file)
+            self.monitor.close()
+        shop = report['hosts']['shop.test']
+        for stage in ('connect_ttfb', 'download', 'parse', 'size'):
+            self.assertEqual(shop[stage]['count'], 8)
+        self.assertEqual(shop['size']['sum'], sum(len(page.encode('utf-8')) for page in self.pages.values()))
+        self.assertEqual(report['hosts']['down.test']['errors'], {'HTTP 500': 1})
+        self.assertEqual(report['stages']['write']['count'], 1)
+        self.assertNotIn('history', report['hosts'])
+        summary = self.monitor.metrics.summary()
+        self.assertIn('shop.test', summary)
+        self.assertIn('etapy lokalne: write', summary)
+
+        histogram = LogHistogram(unit=1.0)
+        for value in range(1, 1001):
+            histogram.add(value)
+        self.assertLessEqual(abs(histogram.quantile(0.5) - 500) / 500, 0.2)
+        self.assertEqual(histogram.quantile(1.0), 1000)
+
+    def test_scalar_timeout_and_default_budget(self):
+        """Test that a single-number timeout works with a cycle deadline, which is on by default."""
+        monitor = PriceMonitor(products=list(self.monitor.products), timeout=10)
+        self.assertIsNotNone(monitor.cycle_budget)
+        monitor.fetcher = PriceFetcher(timeout=10, session=self.session, rate=1000, burst=1000)
+        self.assertEqual(monitor.fetcher.timeout, (10, 10))
+        timeouts, original_get = [], self.session.get
+        self.session.get = lambda url, timeout=None, headers=None: timeouts.append(timeout) or original_get(url)
+        monitor.update_all_prices(budget=5)
+        self.assertEqual(len(timeouts), 8)
+        self.assertTrue(all(len(timeout) == 2 and 0 < min(timeout) <= 5 for timeout in timeouts))
+
+    def test_price_history_append_and_range(self):
+        """Test that each tick appends rows and range queries return them in order."""
+        with tempfile.TemporaryDirectory() as directory:
+            history = PriceHistory(os.path.join(directory, 'ceny.db'))
+            products = self.monitor.products[:2]
+            for day in range(1, 4):
+                products[0].current_price = 10.0 * day
+                history.append(products, timestamp=f"2024-01-0{day} 12:00:00")
+            rows = history.query(product="Book 0", start="2024-01-02", end="2024-01-03 23:59:59")
+            self.assertEqual(rows, [("Book 0", "2024-01-02 12:00:00", 20.0), ("Book 0", "2024-01-03 12:00:00", 30.0)])
+            self.assertEqual(len(history.query()), 6)
+            history.close()
+
+    def test_legacy_csv_history_import(self):
+        """Test that an old list-per-row CSV history is migrated into the SQLite store."""
+        with tempfile.TemporaryDirectory() as directory:
+            legacy = os.path.join(directory, 'ceny.csv')
+            with open(legacy, 'w', newline='') as file:
+                file.write('Book 0,"[1.0, 2.0]","[\'2024-01-01 10:00:00\', \'2024-01-02 10:00:00\']",http://x\n')
+            history = self.monitor.history(legacy)
+            self.assertEqual(history.path, os.path.join(directory, 'ceny.db'))
+            self.monitor.append_prices_to_history(legacy)
+            rows = history.query(product="Book 0")
+            self.assertEqual([price for name, timestamp, price in rows], [1.0, 2.0, 0.0])
+            history.close()
+
+    def test_legacy_csv_imported_once_by_either_name(self):
+        """Test that a sibling CSV is imported into an existing database once, also after a restart."""
+        with tempfile.TemporaryDirectory() as directory:
+            legacy = os.path.join(directory, 'ceny.csv')
+            with open(legacy, 'w', newline='') as file:
+                file.write('Book 0,"[1.0, 2.0]","[\'2024-01-01 10:00:00\', \'2024-01-02 10:00:00\']",http://x\n')
+            database = os.path.join(directory, 'ceny.db')
+            PriceHistory(database).close()
+            self.monitor.append_prices_to_history(database)
+            self.assertEqual(len(self.monitor.history(legacy).query(product="Book 0")), 3)
+            self.monitor.close()
+
+            monitor = PriceMonitor()
+            history = monitor.history(legacy)
+            self.assertEqual(len(history.query(product="Book 0")), 3)
+            # database migrated before the import marker existed: rows are there, the marker is not
+            with history._connection:
+                history._connection.execute('DELETE FROM imports')
+            self.assertEqual(history.import_legacy_csv(legacy), 0)
+            self.assertEqual(len(history.query(product="Book 0")), 3)
+            monitor.close()
+
+    def test_history_opened_once_under_concurrency(self):
+        """Test that parallel first writes to a legacy CSV history import it exactly once."""
+        with tempfile.TemporaryDirectory() as directory:
+            legacy = os.path.join(directory, 'ceny.csv')
+            with open(legacy, 'w', newline='') as file:
+                file.write('Book 0,"[1.0, 2.0]","[\'2024-01-01 10:00:00\', \'2024-01-02 10:00:00\']",http://x\n')
+            barrier = threading.Barrier(4)
+
+            def open_history():
+                barrier.wait()
+                self.monitor.history(legacy)
+
+            threads = [threading.Thread(target=open_history) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(self.monitor.history(legacy).query()), 2)
+            self.assertEqual(len(self.monitor._histories), 1)
+            self.monitor.close()
+
+    def test_adaptive_scheduler_polls_volatile_products_more(self):
+        """Test that a product whose price keeps changing is polled more often than stable ones."""
+        volatile_url = list(self.pages)[0]
+        session, original_get = self.session, self.session.get
+
+        def get(url, timeout=None, headers=None):
+            if url == volatile_url:
+                self.pages[url] = product_page(f"£{len(session.requests)}.00")
+            return original_get(url, timeout, headers)
+
+        session.get, session.delay = get, 0.0
+        with tempfile.TemporaryDirectory() as directory:
+            scheduler = self.monitor.automatic_price_update(os.path.join(directory, 'ceny.db'), interval=0.1,
+                                                            min_interval=0.02, max_interval=0.5)
+            time.sleep(1.0)
+            scheduler.stop()
+            polls = [scheduler.polls[product] for product in self.monitor.products]
+            self.assertGreater(polls[0], 2 * max(polls[1:]))
+            self.assertGreater(scheduler.intervals[self.monitor.products[1]], 0.1)
+            self.assertEqual(scheduler.intervals[self.monitor.products[0]], 0.02)
+            observations = self.monitor.history(os.path.join(directory, 'ceny.db')).query(product="Book 0")
+            self.assertEqual(len(observations), polls[0])
+            self.monitor.history(os.path.join(directory, 'ceny.db')).close()
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file